@@ -1,30 +1,19 @@
-import boto3
-from langchain_aws import ChatBedrock
+import argparse
+import asyncio
+import re
+
 from langchain_core.messages.human import HumanMessage
 from langchain_core.messages.system import SystemMessage
 from tqdm import tqdm
 
-# Adhoc queries against Claude to find new strategies
+from categories import add_categories, load_categories, save_categories, unique_name
+from engine import Engine
 
+# Adhoc queries against Claude to find new strategies, and mining them into the category registry
 
-def _main():
-    model = ChatBedrock(
-        client=boto3.client(
-            service_name="bedrock-runtime",
-            region_name="ap-southeast-2",
-        ),
-        model_id="anthropic.claude-3-sonnet-20240229-v1:0",
-        model_kwargs={
-            "max_tokens": 4096,
-            "temperature": 0.7,
-            "top_k": 250,
-            "top_p": 1,
-            "stop_sequences": ["\n\nHuman"],
-        },
-    )
+instruction_pattern = re.compile(r'<instruction name="([^"]+)">(.*?)</instruction>', re.DOTALL)
 
-    system_message = SystemMessage(
-        """
+instruction_criteria = """
             You are a senior Financial Analyst working for an Australian financial institution.
             You are given International Financial Market Reports.
             You find salient points in those documents.
@@ -42,26 +31,97 @@ def _main():
             <example>
             Find a significant fact that a Financial Analyst would find important, where that fact is only apparent when considering two different pages of the document. The fact must not be apparent when looking at just one page.
             </example>
+"""
+
+messages = [
+    # HumanMessage(
+    #     content=f"""
+    #         Generate a search instruction within for the type of fact that you'd look for first when reviewing a document.
+    #     """
+    # ),
+    HumanMessage(
+        content=f"""
+            Generate a search instruction for facts that aren't always apparent by doing a superficial scan of the document.
+        """
+    ),
+]
 
-            Output only the search instruction. 
-            Do not include any preamble or repeat the question.
+
+def mining_message(variant, message, count, categories) -> HumanMessage:
+    existing = "\n".join(f"<existing>{instruction}</existing>" for instruction in categories.values())
+
+    # The variant number keeps otherwise identical calls distinct, so the LLM cache doesn't collapse them
+    return HumanMessage(
+        content=f"""{variant}.
+            {message.content}
+
+            Here are the instructions we already have. Every new instruction must look for a different kind of fact to all of them.
+            {existing}
+
+            Generate {count} distinct search instructions, each looking for a different kind of fact.
+            Output each inside <instruction name="..."></instruction> tags, where name is a short snake_case name for the kind of fact.
         """
     )
 
-    messages = [
-        # HumanMessage(
-        #     content=f"""
-        #         Generate a search instruction within for the type of fact that you'd look for first when reviewing a document.
-        #     """
-        # ),
-        HumanMessage(
-            content=f"""
-            Generate a search instruction for facts that aren't always apparent by doing a superficial scan of the document.
-        """
-        ),
-    ]
 
-    n = 3
+def parse_instructions(text):
+    # A list, not a dict, so two instructions given the same name both survive
+    return [(name.strip(), " ".join(instruction.split())) for name, instruction in instruction_pattern.findall(text)]
+
+
+def fake_mining_response(messages):
+    # Instructions drawn from a small fixed pool by variant, so mining offline produces some duplicates
+    variant = int(re.search(r"^\s*(\d+)\.", messages[-1].content).group(1))
+    count = int(re.search(r"Generate (\d+) distinct", messages[-1].content).group(1))
+    pool = {
+        "capex_shift": "Compare planned capital expenditure by technology across the years shown to find where investment is moving fastest.",
+        "price_sensitivity": "Find a stated sensitivity of an outcome to an energy price assumption and quantify it.",
+        "target_gap": "Locate an emissions or deployment target and the gap between it and the current trajectory.",
+        "storage_constraint": "Identify a physical or supply chain constraint on grid storage that the report quantifies.",
+        "policy_effect": "Find a policy incentive and the measured change in adoption attributed to it.",
+        "demand_revision": "Find a demand forecast that was revised and the size and direction of the revision.",
+    }
+    names = list(pool)
+
+    return "\n".join(
+        f'<instruction name="{name}">{pool[name]}</instruction>'
+        for name in [names[(variant + k) % len(names)] for k in range(count)]
+    )
+
+
+async def amine(model, system_message, messages, categories, variants=4, count=10, concurrency=8, requests_per_second=None, threshold=0.5):
+    engine = Engine(concurrency=concurrency, requests_per_second=requests_per_second)
+    progress = tqdm(desc="Mining instructions", total=len(messages) * variants)
+
+    async def run(variant, message):
+        mining_messages = [system_message, mining_message(variant=variant, message=message, count=count, categories=categories)]
+        response = await engine.call(lambda: model.ainvoke(input=mining_messages), tags={"step": "mine", "variant": variant})
+        progress.update(1)
+
+        return parse_instructions(response.content)
+
+    responses = await asyncio.gather(*[run(variant, message) for message in messages for variant in range(variants)])
+    progress.close()
+
+    from dedup import Deduplicator
+
+    # Existing categories go in first, so anything close to one of them is dropped too
+    dedup = Deduplicator(threshold=threshold)
+    for instruction in categories.values():
+        dedup.check("instructions", instruction, "")
+
+    mined = {}
+    for response in responses:
+        for name, instruction in response:
+            novel, _ = dedup.check("instructions", instruction, "")
+            if novel:
+                # Already in the dedup index, so dropping it on a name clash would lose it for good
+                mined[unique_name(name, mined)] = instruction
+
+    return mined
+
+
+def chat(model, system_message, messages, n=3):
     for message in messages:
         print(f"{20*'='}\n{message.content}\n{20*'='}")
 
@@ -71,6 +131,67 @@ def _main():
             print(f"{result}")
 
 
+def _main():
+    parser = argparse.ArgumentParser(description="Ask for new search instructions, or mine them into the category registry")
+    parser.add_argument("--mine", action="store_true", help="Mine many instructions concurrently and add the novel ones to the registry")
+    parser.add_argument("--variants", type=int, default=4, help="Calls per message when mining")
+    parser.add_argument("--count", type=int, default=10, help="Instructions asked for per call when mining")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests-per-second", type=float, default=2)
+    parser.add_argument("--dry-run", action="store_true", help="Print mined instructions without saving them")
+    parser.add_argument("--fake", action="store_true", help="Mine with a local fake model, offline")
+    args = parser.parse_args()
+
+    if args.fake:
+        from fake_model import FakeChatModel
+
+        model = FakeChatModel(respond=fake_mining_response)
+    else:
+        from bedrock import chat_model
+
+        model = chat_model(max_pool_connections=max(10, args.concurrency))
+
+    if not args.mine:
+        system_message = SystemMessage(
+            instruction_criteria
+            + """
+            Output only the search instruction. 
+            Do not include any preamble or repeat the question.
+        """
+        )
+        chat(model=model, system_message=system_message, messages=messages)
+        return
+
+    system_message = SystemMessage(
+        instruction_criteria
+        + """
+            Output only the tagged search instructions.
+            Do not include any preamble or repeat the question.
+        """
+    )
+    categories = load_categories()
+    mined = asyncio.run(
+        amine(
+            model=model,
+            system_message=system_message,
+            messages=messages,
+            categories=categories,
+            variants=args.variants,
+            count=args.count,
+            concurrency=args.concurrency,
+            requests_per_second=args.requests_per_second,
+        )
+    )
+
+    merged, added = add_categories(categories, mined)
+    for name, instruction in added.items():
+        print(f"{name:30} {instruction}")
+    print(f"{len(added)} new categories, {len(merged)} in total")
+
+    if not args.dry_run:
+        save_categories(merged)
+
+
 if __name__ == "__main__":
     _main()
 
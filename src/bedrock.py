@@ -0,0 +1,206 @@
+import os
+import random
+import threading
+import time
+from functools import lru_cache
+
+import boto3
+from botocore.config import Config
+from langchain_aws import ChatBedrock
+
+from engine import is_throttle
+from metrics import current_call
+
+# Shared Bedrock clients, and a router that spreads calls across regions
+
+default_region = "ap-southeast-2"
+model_id = "anthropic.claude-3-sonnet-20240229-v1:0"
+model_kwargs = {
+    "max_tokens": 4096,
+    "temperature": 0.7,
+    "top_k": 250,
+    "top_p": 1,
+    "stop_sequences": ["\n\nHuman"],
+}
+
+
+def count_retries(parsed, **kwargs):
+    # botocore's own retries never reach Engine, so add them to the call's record; fires on errors too
+    record = current_call.get()
+    if record is not None:
+        record["retries"] += parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+
+
+@lru_cache(maxsize=None)
+def bedrock_client(
+    region_name=default_region,
+    max_pool_connections=50,
+    max_attempts=3,
+    retry_mode="adaptive",
+    endpoint_url=None,
+):
+    # One client per region and settings for the whole process: boto3 clients are thread safe, and
+    # sharing one keeps a single connection pool and a single adaptive rate limiter per region.
+    # max_attempts includes the first attempt, and Engine retries on top of it, so keep it low
+    client = boto3.client(
+        service_name="bedrock-runtime",
+        region_name=region_name,
+        # Point at a local stub (see bedrock_stub.py) to exercise the full client path offline
+        endpoint_url=endpoint_url or os.environ.get("BEDROCK_ENDPOINT_URL"),
+        config=Config(
+            max_pool_connections=max_pool_connections,
+            retries={"total_max_attempts": max_attempts, "mode": retry_mode},
+        ),
+    )
+    client.meta.events.register("after-call.bedrock-runtime", count_retries)
+
+    return client
+
+
+def chat_model(region_name=default_region, cache=None, max_pool_connections=50, max_attempts=3, retry_mode="adaptive"):
+    return ChatBedrock(
+        client=bedrock_client(
+            region_name=region_name,
+            max_pool_connections=max_pool_connections,
+            max_attempts=max_attempts,
+            retry_mode=retry_mode,
+        ),
+        model_id=model_id,
+        model_kwargs=model_kwargs,
+        cache=cache,
+    )
+
+
+class RegionRouter:
+    def __init__(self, regions, alpha=0.2, decay=0.8, throttle_penalty=4.0):
+        self.regions = list(regions)
+        self.alpha = alpha
+        self.decay = decay
+        self.throttle_penalty = throttle_penalty
+        self.lock = threading.Lock()
+        self.stats = {
+            region: {"latency": None, "throttle_rate": 0.0, "calls": 0, "throttles": 0}
+            for region in self.regions
+        }
+
+    def weights(self):
+        with self.lock:
+            known = [s["latency"] for s in self.stats.values() if s["latency"] is not None]
+            # Regions with no observations yet are assumed average, so they still get tried
+            default_latency = sum(known) / len(known) if known else 1.0
+
+            return [
+                1 / ((s["latency"] or default_latency) * (1 + self.throttle_penalty * s["throttle_rate"]))
+                for s in self.stats.values()
+            ]
+
+    def choose(self):
+        return random.choices(self.regions, weights=self.weights())[0]
+
+    def record(self, region, seconds=None, throttled=False):
+        with self.lock:
+            stats = self.stats[region]
+            stats["calls"] += 1
+            stats["throttles"] += throttled
+            stats["throttle_rate"] = self.decay * stats["throttle_rate"] + (1 - self.decay) * throttled
+
+            if seconds is not None and not throttled:
+                previous = stats["latency"]
+                stats["latency"] = seconds if previous is None else (1 - self.alpha) * previous + self.alpha * seconds
+
+    def summary(self):
+        with self.lock:
+            return {region: dict(stats) for region, stats in self.stats.items()}
+
+
+class RoutedChatModel:
+    def __init__(self, models, router):
+        self.models = models
+        self.router = router
+
+    def _choose(self):
+        region = self.router.choose()
+        record = current_call.get()
+        if record is not None:
+            record["region"] = region
+
+        return region
+
+    def _succeeded(self, region, start):
+        # A response served from the LLM cache says nothing about the region, and its near-zero latency
+        # would pull all traffic onto whichever region happened to serve the hits
+        record = current_call.get()
+        if record is not None and record.get("cache_hit"):
+            return
+
+        self.router.record(region, seconds=time.perf_counter() - start)
+
+    def _failed(self, region, exception):
+        # Only throttling counts against a region; other errors are the caller's to retry
+        self.router.record(region, throttled=is_throttle(exception))
+
+    def invoke(self, input, **kwargs):
+        region = self._choose()
+        start = time.perf_counter()
+        try:
+            message = self.models[region].invoke(input=input, **kwargs)
+        except Exception as e:
+            self._failed(region, e)
+            raise
+
+        self._succeeded(region, start)
+
+        return message
+
+    async def ainvoke(self, input, **kwargs):
+        region = self._choose()
+        start = time.perf_counter()
+        try:
+            message = await self.models[region].ainvoke(input=input, **kwargs)
+        except Exception as e:
+            self._failed(region, e)
+            raise
+
+        self._succeeded(region, start)
+
+        return message
+
+    async def astream(self, input, **kwargs):
+        region = self._choose()
+        start = time.perf_counter()
+        stream = self.models[region].astream(input=input, **kwargs)
+
+        try:
+            first = True
+            async for chunk in stream:
+                if first:
+                    # Time to first token is the comparable latency for streamed calls
+                    self.router.record(region, seconds=time.perf_counter() - start)
+                    first = False
+                yield chunk
+        except Exception as e:
+            self._failed(region, e)
+            raise
+        finally:
+            await stream.aclose()
+
+
+def load_chat_model(regions=None, cache=None, max_pool_connections=50):
+    regions = regions or [default_region]
+    if len(regions) == 1:
+        return chat_model(region_name=regions[0], cache=cache, max_pool_connections=max_pool_connections)
+
+    # No client-side retries when routing: a throttle has to reach the router to count against its
+    # region, and Engine's retry then goes wherever the router now prefers
+    models = {
+        region: chat_model(
+            region_name=region,
+            cache=cache,
+            max_pool_connections=max_pool_connections,
+            max_attempts=1,
+            retry_mode="standard",
+        )
+        for region in regions
+    }
+
+    return RoutedChatModel(models=models, router=RegionRouter(regions))
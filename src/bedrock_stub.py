@@ -0,0 +1,96 @@
+import argparse
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+from fake_model import PrefixCache, fake_generation_response
+
+# Local stand-in for the bedrock-runtime InvokeModel endpoint, for exercising the real boto3/ChatBedrock
+# path offline. Run it, then set BEDROCK_ENDPOINT_URL=http://localhost:8765 and dummy AWS credentials.
+# Streaming (InvokeModelWithResponseStream) needs AWS event-stream framing and isn't supported.
+# Blocks marked cache_control are prompt cached, so a prefix that isn't byte-identical shows up as cache writes
+
+
+def make_handler(latency, throttle_rate, prefix_cache):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body, headers=None):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+
+            if not self.path.endswith("/invoke"):
+                self._send(501, {"message": "Only InvokeModel is stubbed"})
+                return
+
+            if random.random() < throttle_rate:
+                self._send(429, {"message": "Too many requests"}, {"x-amzn-ErrorType": "ThrottlingException"})
+                return
+
+            time.sleep(latency)
+
+            # Anthropic messages API: content is a string or a list of text blocks
+            messages = [SimpleNamespace(type="system", content=request.get("system", ""))]
+            for message in request["messages"]:
+                messages.append(SimpleNamespace(type=message["role"], content=message["content"]))
+
+            text = fake_generation_response(messages)
+            usage = prefix_cache.usage(messages, text)
+            details = usage["input_token_details"]
+            self._send(
+                200,
+                {
+                    "id": "msg_stub",
+                    "type": "message",
+                    "role": "assistant",
+                    "content": [{"type": "text", "text": text}],
+                    "stop_reason": "end_turn",
+                    "usage": {
+                        "input_tokens": usage["input_tokens"],
+                        "output_tokens": usage["output_tokens"],
+                        "cache_read_input_tokens": details["cache_read"],
+                        "cache_creation_input_tokens": details["cache_creation"],
+                    },
+                },
+                # boto3's InvokeModel callers read usage from these headers
+                {
+                    "x-amzn-bedrock-input-token-count": str(usage["input_tokens"]),
+                    "x-amzn-bedrock-output-token-count": str(usage["output_tokens"]),
+                    "x-amzn-bedrock-cache-read-input-token-count": str(details["cache_read"]),
+                    "x-amzn-bedrock-cache-write-input-token-count": str(details["cache_creation"]),
+                },
+            )
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Serve a stub bedrock-runtime endpoint locally")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of calls answered with a 429")
+    args = parser.parse_args()
+
+    prefix_cache = PrefixCache()
+    server = ThreadingHTTPServer(("localhost", args.port), make_handler(args.latency, args.throttle_rate, prefix_cache))
+    print(f"Stub bedrock-runtime listening on http://localhost:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"Prompt cache: {prefix_cache.summary()}")
+
+
+if __name__ == "__main__":
+    _main()
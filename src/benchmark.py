@@ -0,0 +1,252 @@
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from langchain_core.messages import AIMessage
+from langchain_core.messages.system import SystemMessage
+from langchain_core.outputs import ChatGeneration
+
+import pdf_loader
+from categories import load_categories
+from fake_model import FakeChatModel, PrefixCache, fake_generation_response
+from llm_cache import LRUStore, SQLiteStore, TieredCache
+from main import agenerate_examples, doc_path, load_doc
+
+# Offline benchmarks for the generator, the PDF extractor and the LLM cache.
+# Results are saved as JSON so runs before and after a change can be compared with --compare
+
+benchmarks_dir = Path(__file__).parents[1] / "output" / "benchmarks"
+
+
+def bench_generation(text, concurrencies, n, latency, seconds_per_token, output_tokens, stream, cache_prefix=False):
+    system_message = SystemMessage("You are a financial analyst who deeply reviews Financial Market Reports.")
+    evaluation_category_prompts = load_categories()
+
+    results = {}
+    for concurrency in concurrencies:
+        # A fresh prompt cache per level; every call after the first should read the document prefix back
+        prefix_cache = PrefixCache() if cache_prefix else None
+        model = FakeChatModel(
+            respond=fake_generation_response,
+            latency=latency,
+            seconds_per_token=seconds_per_token,
+            output_tokens=output_tokens,
+            prefix_cache=prefix_cache,
+        )
+
+        start = time.perf_counter()
+        examples = asyncio.run(
+            agenerate_examples(
+                evaluation_category_prompts=evaluation_category_prompts,
+                n=n,
+                model=model,
+                system_message=system_message,
+                text=text,
+                concurrency=concurrency,
+                stream=stream,
+                cache_prefix=cache_prefix,
+                verbose=False,
+            )
+        )
+        seconds = time.perf_counter() - start
+
+        results[f"concurrency_{concurrency}"] = {
+            "examples": len(examples),
+            "seconds": seconds,
+            "examples_per_second": len(examples) / seconds,
+        }
+        if prefix_cache is not None:
+            results[f"concurrency_{concurrency}"]["prompt_cache"] = prefix_cache.summary()
+
+    return results
+
+
+def bench_extraction(input_file, workers):
+    results = {}
+
+    start = time.perf_counter()
+    pages = sum(1 for _ in pdf_loader.iter_pages(input_file=input_file))
+    seconds = time.perf_counter() - start
+    results["sequential"] = {"pages": pages, "seconds": seconds, "pages_per_second": pages / seconds}
+
+    with tempfile.TemporaryDirectory() as tmp, ProcessPoolExecutor(max_workers=workers) as executor:
+        start = time.perf_counter()
+        pdf_loader.write_markdown(
+            input_file=input_file,
+            output_file=Path(tmp) / "doc.txt",
+            cache=pdf_loader.PageCache(Path(tmp) / "cache"),
+            executor=executor,
+            workers=workers,
+        )
+        seconds = time.perf_counter() - start
+        results[f"process_pool_{workers}"] = {"pages": pages, "seconds": seconds, "pages_per_second": pages / seconds}
+
+        # Same document again, now served entirely from the page cache
+        start = time.perf_counter()
+        pdf_loader.write_markdown(
+            input_file=input_file,
+            output_file=Path(tmp) / "doc.txt",
+            cache=pdf_loader.PageCache(Path(tmp) / "cache"),
+        )
+        seconds = time.perf_counter() - start
+        results["page_cache"] = {"pages": pages, "seconds": seconds, "pages_per_second": pages / seconds}
+
+    return results
+
+
+def bench_cache(entries, lookups):
+    llm_string = "fake-chat"
+    generations = [ChatGeneration(message=AIMessage(content="<answer>x</answer>" * 20))]
+    prompts = [f"prompt {n}" for n in range(entries)]
+
+    def throughput(cache, keys):
+        start = time.perf_counter()
+        for n in range(lookups):
+            cache.lookup(keys[n % len(keys)], llm_string)
+        seconds = time.perf_counter() - start
+
+        return {"lookups": lookups, "seconds": seconds, "lookups_per_second": lookups / seconds}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SQLiteStore(database_path=Path(tmp) / "cache.db")
+        cache = TieredCache(memory=LRUStore(max_entries=entries), store=store)
+        start = time.perf_counter()
+        for prompt in prompts:
+            cache.update(prompt, llm_string, generations)
+        update_seconds = time.perf_counter() - start
+
+        results = {
+            "update": {"updates": entries, "seconds": update_seconds, "updates_per_second": entries / update_seconds},
+            "memory_hit": throughput(cache, prompts),
+            # An LRU of one entry pushes every lookup through to SQLite
+            "disk_hit": throughput(TieredCache(memory=LRUStore(max_entries=1), store=store), prompts),
+            "miss": throughput(cache, [f"missing {n}" for n in range(entries)]),
+        }
+
+    return results
+
+
+def bench_startup(repeats):
+    # Fresh interpreters, so every run pays the full import cost; the median smooths out disk cache noise
+    src_dir = Path(__file__).parent
+
+    def median_seconds(args):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, *args], cwd=src_dir, capture_output=True, check=True)
+            times.append(time.perf_counter() - start)
+
+        return statistics.median(times)
+
+    results = {}
+    for command in ["--help", "extract --help", "generate --help", "mine --help", "grade --help"]:
+        seconds = median_seconds(["cli.py", *command.split()])
+        results[f"cli {command}"] = {"seconds": seconds, "starts_per_second": 1 / seconds}
+
+    # Import cost of each module alone, net of interpreter start-up
+    baseline = median_seconds(["-c", "pass"])
+    for module in ["pdf_loader", "main", "adhoc_chat", "grader", "bedrock", "fake_model"]:
+        seconds = max(median_seconds(["-c", f"import {module}"]) - baseline, 1e-6)
+        results[f"import {module}"] = {"seconds": seconds, "imports_per_second": 1 / seconds}
+
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before_file, after_file):
+    before = json.loads(Path(before_file).read_text())["results"]
+    after = json.loads(Path(after_file).read_text())["results"]
+
+    for suite, cases in after.items():
+        for case, metrics in cases.items():
+            old = before.get(suite, {}).get(case)
+            if old is None:
+                continue
+
+            for metric, value in metrics.items():
+                if metric.endswith("_per_second") and old.get(metric):
+                    print(f"{suite}.{case}.{metric:24} {old[metric]:>12.1f} -> {value:>12.1f}  ({value / old[metric]:.2f}x)")
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for generation, extraction, caching and start-up")
+    parser.add_argument("--only", choices=["generation", "extraction", "cache", "startup"], action="append")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--n", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake model time to first token")
+    parser.add_argument("--seconds-per-token", type=float, default=0.001)
+    parser.add_argument("--output-tokens", type=int, default=200)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--cache-prefix", action="store_true", help="Document-first prompts against a fake prompt cache")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--cache-entries", type=int, default=1000)
+    parser.add_argument("--cache-lookups", type=int, default=20000)
+    parser.add_argument("--startup-repeats", type=int, default=5)
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Compare two saved runs")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    suites = args.only or ["generation", "extraction", "cache", "startup"]
+    results = {}
+
+    if "generation" in suites:
+        results["generation"] = bench_generation(
+            text=load_doc(),
+            concurrencies=args.concurrency,
+            n=args.n,
+            latency=args.latency,
+            seconds_per_token=args.seconds_per_token,
+            output_tokens=args.output_tokens,
+            stream=args.stream,
+            cache_prefix=args.cache_prefix,
+        )
+    if "extraction" in suites:
+        results["extraction"] = bench_extraction(input_file=doc_path(), workers=args.workers)
+    if "cache" in suites:
+        results["cache"] = bench_cache(entries=args.cache_entries, lookups=args.cache_lookups)
+    if "startup" in suites:
+        results["startup"] = bench_startup(repeats=args.startup_repeats)
+
+    run = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "args": {k: v for k, v in vars(args).items() if k != "compare"},
+        "results": results,
+    }
+
+    benchmarks_dir.mkdir(parents=True, exist_ok=True)
+    output_file = benchmarks_dir / f"{run['timestamp'].replace(':', '')}.json"
+    output_file.write_text(json.dumps(run, indent=2))
+
+    print(json.dumps(results, indent=2))
+    print(f"Saved to {output_file}")
+
+
+if __name__ == "__main__":
+    _main()
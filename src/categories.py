@@ -0,0 +1,42 @@
+import json
+from pathlib import Path
+
+# The registry of evaluation categories: name -> search instruction, in generation order.
+# Seeded by hand and grown by `adhoc_chat.py --mine`
+
+registry_path = Path(__file__).parents[1] / "data" / "categories.json"
+
+
+def load_categories(path=registry_path):
+    return json.loads(Path(path).read_text())
+
+
+def save_categories(categories, path=registry_path):
+    # Written to a temporary file first, so a crash never leaves a half-written registry
+    path = Path(path)
+    partial = path.with_suffix(".partial")
+    partial.write_text(json.dumps(categories, indent=4) + "\n")
+    partial.replace(path)
+
+
+def unique_name(name, taken):
+    # Clashing names get a numeric suffix rather than replacing what's already there
+    candidate = name
+    suffix = 2
+    while candidate in taken:
+        candidate = f"{name}_{suffix}"
+        suffix += 1
+
+    return candidate
+
+
+def add_categories(categories, mined):
+    # Mined names never overwrite an existing category
+    merged = dict(categories)
+    added = {}
+    for name, instruction in mined.items():
+        name = unique_name(name, merged)
+        merged[name] = instruction
+        added[name] = instruction
+
+    return merged, added
@@ -0,0 +1,149 @@
+import argparse
+import json
+import math
+import re
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import pdf_loader
+from retrieval import pages_digest, tokenize
+
+# Checks locally, without a model call, that each answer is supported by the pages it cites
+
+
+def terms(text):
+    # Content-word unigrams plus bigrams: unigrams catch paraphrase, bigrams reward matching phrasing
+    words = tokenize(text)
+
+    return set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+
+
+def parse_pages(page):
+    # "3", "3, 5", "Pages 3-5", "12 and 14"; anything else cites nothing. None when it isn't a page
+    # reference at all: a <page> tag that failed to parse leaves the whole response here, and every
+    # number in it ("17%", "24 GW") would otherwise be read as a cited page
+    page = str(page)
+    if "<" in page or len(page) > 40:
+        return None
+
+    cited = set()
+    for start, end in re.findall(r"(\d+)(?:\s*[-–]\s*(\d+))?", page):
+        start = int(start)
+        end = int(end) if end else start
+        if end - start <= 20:
+            cited.update(range(start, end + 1))
+
+    return cited
+
+
+class CitationIndex:
+    def __init__(self, postings, page_count, digest):
+        self.postings = postings
+        self.page_count = page_count
+        self.digest = digest
+        self.idf = {
+            term: math.log(1 + page_count / len(pages))
+            for term, pages in postings.items()
+        }
+
+    @classmethod
+    def build(cls, pages):
+        postings = defaultdict(set)
+        for page_number, page in enumerate(pages, start=1):
+            for term in terms(page):
+                postings[term].add(page_number)
+
+        return cls(postings=dict(postings), page_count=len(pages), digest=pages_digest(pages))
+
+    @classmethod
+    def load_or_build(cls, path, pages):
+        path = Path(path)
+        if path.exists():
+            data = json.loads(path.read_text())
+            if data["digest"] == pages_digest(pages):
+                postings = {term: set(pages) for term, pages in data["postings"].items()}
+                return cls(postings=postings, page_count=data["page_count"], digest=data["digest"])
+
+        index = cls.build(pages)
+        data = {
+            "digest": index.digest,
+            "page_count": index.page_count,
+            "postings": {term: sorted(pages) for term, pages in index.postings.items()},
+        }
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(data))
+
+        return index
+
+    def _weight(self, term):
+        # Terms that appear nowhere in the document still count against support, at the highest weight
+        return self.idf.get(term, math.log(1 + self.page_count))
+
+    def page_support(self, answer_terms):
+        total = sum(self._weight(term) for term in answer_terms)
+        scores = Counter()
+        for term in answer_terms:
+            for page_number in self.postings.get(term, ()):
+                scores[page_number] += self.idf[term]
+
+        return {page_number: score / total for page_number, score in scores.items()} if total else {}
+
+    def verify(self, answer, page, threshold=0.5, suggestions=3):
+        answer_terms = terms(answer)
+        parsed = parse_pages(page)
+        cited = {p for p in parsed or () if 1 <= p <= self.page_count}
+        total = sum(self._weight(term) for term in answer_terms)
+
+        # Support from the cited pages together, so a fact split across two cited pages still counts
+        covered = {term for term in answer_terms if cited & self.postings.get(term, set())}
+        support = sum(self.idf[term] for term in covered) / total if total else 0.0
+
+        best = sorted(self.page_support(answer_terms).items(), key=lambda item: -item[1])[:suggestions]
+
+        return {
+            "cited_pages": sorted(cited),
+            "unparsed_citation": parsed is None,
+            "support": support,
+            "supported": support >= threshold,
+            "suggested_pages": [page_number for page_number, _ in best],
+            "suggested_support": [round(score, 3) for _, score in best],
+        }
+
+
+def _main():
+    from main import doc_path, load_pages
+
+    output_dir = Path(__file__).parents[1] / "output"
+
+    parser = argparse.ArgumentParser(description="Verify answers against the pages they cite")
+    parser.add_argument("--eval", type=Path, default=output_dir / "eval.json")
+    parser.add_argument("--document", type=Path, default=doc_path())
+    parser.add_argument("--output", type=Path, default=output_dir / "citations.json")
+    parser.add_argument("--threshold", type=float, default=0.5)
+    args = parser.parse_args()
+
+    pages = load_pages(input_file=args.document)
+    index = CitationIndex.load_or_build(
+        path=pdf_loader.default_cache_dir / f"{args.document.name}.citations.json",
+        pages=pages,
+    )
+    rows = json.loads(args.eval.read_text())
+
+    start = time.perf_counter()
+    verified = [{**row, **index.verify(row["answer"], row["page"], threshold=args.threshold)} for row in rows]
+    seconds = time.perf_counter() - start
+
+    args.output.write_text(json.dumps(verified, indent=2))
+
+    by_category = defaultdict(list)
+    for row in verified:
+        by_category[row["category"]].append(row["supported"])
+    for category, supported in by_category.items():
+        print(f"{category:30} {sum(supported)}/{len(supported)} supported")
+    print(f"Unparsed citations: {sum(row['unparsed_citation'] for row in verified)}")
+    print(f"Verified {len(verified)} rows in {1000 * seconds:.1f} ms")
+
+
+if __name__ == "__main__":
+    _main()
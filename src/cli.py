@@ -0,0 +1,35 @@
+import argparse
+import importlib
+import sys
+
+# One entry point for the everyday jobs. Each subcommand imports only its own module, and heavy
+# dependencies (fitz, boto3, langchain_aws) load only on the paths that use them, so small jobs start fast
+
+commands = {
+    "extract": ("pdf_loader", [], "Extract PDFs to text, through the page cache"),
+    "generate": ("main", [], "Generate the evaluation set for a document"),
+    "mine": ("adhoc_chat", ["--mine"], "Mine search instructions into the category registry"),
+    "grade": ("grader", [], "Grade candidate answers against the eval set"),
+}
+
+
+def _main():
+    parser = argparse.ArgumentParser(
+        description="Evaluation set tools",
+        epilog="\n".join(f"  {name:10} {help}" for name, (_, _, help) in commands.items()),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("command", choices=commands, metavar="command")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="Passed to the subcommand; try <command> --help")
+    args = parser.parse_args()
+
+    module_name, extra_args, _ = commands[args.command]
+    module = importlib.import_module(module_name)
+
+    # Each module parses its own arguments, so the subcommand behaves exactly like running the module
+    sys.argv = [f"{parser.prog} {args.command}", *extra_args, *args.args]
+    module._main()
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,82 @@
+import argparse
+import asyncio
+import json
+import time
+from pathlib import Path
+
+from langchain_core.messages.system import SystemMessage
+
+from categories import load_categories
+from fake_model import FakeChatModel, fake_generation_response
+from main import agenerate_examples, load_doc, load_model
+from metrics import percentile
+
+# Side-by-side latency, token and parse-failure report for separate vs combined generation
+
+
+def summarize(results, wall_seconds):
+    latencies = [result["latency_seconds"] for result in results]
+    count = max(1, len(results))
+
+    return {
+        "examples": len(results),
+        "wall_seconds": wall_seconds,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "input_tokens_per_example": sum(result["input_tokens"] for result in results) / count,
+        "output_tokens_per_example": sum(result["output_tokens"] for result in results) / count,
+        "parse_failures": sum(result["parse_failures"] for result in results),
+        "rows_with_parse_failures": sum(1 for result in results if result["parse_failures"] > 0),
+    }
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Compare separate answer/question calls with one combined call")
+    parser.add_argument("--n", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests-per-second", type=float, default=2)
+    parser.add_argument("--fake", action="store_true", help="Use a local fake model, offline")
+    parser.add_argument("--output", type=Path, default=Path(__file__).parents[1] / "output" / "mode_comparison.json")
+    args = parser.parse_args()
+
+    evaluation_category_prompts = load_categories()
+    text = load_doc()
+    system_message = SystemMessage(
+        """
+            You are a financial analyst who deeply reviews Financial Market Reports.
+        """,
+    )
+
+    # No LLM cache, otherwise the second mode's latencies would be meaningless
+    if args.fake:
+        model = FakeChatModel(respond=fake_generation_response, latency=0.05)
+    else:
+        model = load_model(cache_llm=False)
+
+    report = {}
+    for mode in ["separate", "combined"]:
+        start = time.perf_counter()
+        results = asyncio.run(
+            agenerate_examples(
+                evaluation_category_prompts=evaluation_category_prompts,
+                n=args.n,
+                model=model,
+                system_message=system_message,
+                text=text,
+                concurrency=args.concurrency,
+                requests_per_second=args.requests_per_second,
+                combined=mode == "combined",
+            )
+        )
+        report[mode] = summarize(results, wall_seconds=time.perf_counter() - start)
+
+    print(f"{'':28} {'separate':>12} {'combined':>12}")
+    for metric in report["separate"]:
+        print(f"{metric:28} {report['separate'][metric]:>12.2f} {report['combined'][metric]:>12.2f}")
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,188 @@
+import argparse
+import asyncio
+from itertools import chain, zip_longest
+from pathlib import Path
+
+from langchain_core.messages.system import SystemMessage
+from tqdm import tqdm
+
+import pdf_loader
+from categories import load_categories
+from engine import Engine
+from journal import Journal, write_csv, write_json
+from main import (
+    agenerate_row,
+    generation_settings,
+    load_index,
+    load_model,
+    load_pages,
+    setup_llm_cache,
+)
+from metrics import Metrics
+
+# Generates eval sets for a whole directory of reports with one shared model, cache and worker pool
+
+
+def find_documents(input_dir):
+    input_dir = Path(input_dir)
+    pdfs = sorted(input_dir.glob("*.pdf"))
+
+    # Prefer the PDFs, resolved through the page cache; fall back to text pdf_loader already wrote
+    return pdfs if len(pdfs) > 0 else sorted(input_dir.glob("*.pdf.txt"))
+
+
+def interleave(work_by_document):
+    # Round-robin across documents, so one long report can't hold up the others
+    sentinel = object()
+    rounds = zip_longest(*work_by_document, fillvalue=sentinel)
+
+    return [item for item in chain.from_iterable(rounds) if item is not sentinel]
+
+
+async def agenerate_corpus(
+    documents,
+    evaluation_category_prompts,
+    n,
+    model,
+    system_message,
+    concurrency=8,
+    workers=16,
+    requests_per_second=None,
+    retries=5,
+    top_k=5,
+    combined=False,
+    stream=False,
+):
+    engine = Engine(
+        concurrency=concurrency,
+        requests_per_second=requests_per_second,
+        retries=retries,
+    )
+
+    work_by_document = []
+    for document in documents:
+        completed = document["journal"].completed()
+        work_by_document.append(
+            [
+                (document, category, instruction, i)
+                for i in range(n)
+                for category, instruction in evaluation_category_prompts.items()
+                if (category, i) not in completed
+            ]
+        )
+
+    work = iter(interleave(work_by_document))
+    total = sum(len(items) for items in work_by_document)
+    progress = tqdm(desc="Generating corpus", total=total)
+
+    async def worker():
+        # A fixed pool of workers bounds how many examples are in flight, however large the corpus
+        for document, category, instruction, i in work:
+            result = await agenerate_row(
+                engine=engine,
+                i=i,
+                category=category,
+                instruction=instruction,
+                model=model,
+                system_message=system_message,
+                text=document["text"],
+                pages=document["pages"],
+                index=document["index"],
+                top_k=top_k,
+                combined=combined,
+                stream=stream,
+                document=document["name"],
+            )
+            document["journal"].append(result)
+
+            progress.set_description_str(f"{document['name']}:{category}")
+            progress.update(1)
+
+    await asyncio.gather(*[worker() for _ in range(workers)])
+    progress.close()
+
+
+def _main():
+    base_dir = Path(__file__).parents[1]
+
+    parser = argparse.ArgumentParser(description="Generate evaluation sets for every document in a directory")
+    parser.add_argument("input_dir", type=Path, nargs="?", default=base_dir / "data", help="PDFs or extracted .pdf.txt files")
+    parser.add_argument("--output", type=Path, default=base_dir / "output" / "corpus")
+    parser.add_argument("--n", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=8, help="Model calls in flight")
+    parser.add_argument("--workers", type=int, default=16, help="Examples in flight")
+    parser.add_argument("--requests-per-second", type=float, default=2)
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--retrieval", action="store_true")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--no-resume", action="store_true")
+    parser.add_argument("--combined", action="store_true")
+    parser.add_argument("--stream", action="store_true")
+    args = parser.parse_args()
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    evaluation_category_prompts = load_categories()
+    llm_cache = setup_llm_cache()
+    metrics = Metrics()
+    model = load_model(cache_llm=True, metrics=metrics)
+    system_message = SystemMessage(
+        """
+            You are a financial analyst who deeply reviews Financial Market Reports.
+        """,
+    )
+
+    documents = []
+    for input_file in find_documents(args.input_dir):
+        name = input_file.name.removesuffix(".txt").removesuffix(".pdf")
+        pages = load_pages(input_file=input_file)
+        settings = generation_settings(
+            input_file=input_file,
+            retrieval=args.retrieval,
+            top_k=args.top_k,
+            combined=args.combined,
+        )
+        try:
+            journal = Journal(args.output / name / "eval.journal.jsonl", resume=not args.no_resume, settings=settings)
+        except ValueError as e:
+            parser.error(str(e))
+        documents.append(
+            {
+                "name": name,
+                "pages": pages,
+                "text": pdf_loader.join_pages(pages),
+                "index": load_index(input_file=input_file, pages=pages) if args.retrieval else None,
+                "journal": journal,
+            }
+        )
+
+    asyncio.run(
+        agenerate_corpus(
+            documents=documents,
+            evaluation_category_prompts=evaluation_category_prompts,
+            n=args.n,
+            model=model,
+            system_message=system_message,
+            concurrency=args.concurrency,
+            workers=args.workers,
+            requests_per_second=args.requests_per_second,
+            retries=args.retries,
+            top_k=args.top_k,
+            combined=args.combined,
+            stream=args.stream,
+        )
+    )
+
+    keys = [(category, i) for category in evaluation_category_prompts for i in range(args.n)]
+    for document in documents:
+        journal = document["journal"]
+        journal.close()
+        write_csv(journal, journal.path.parent / "eval.csv", keys=keys)
+        write_json(journal, journal.path.parent / "eval.json", keys=keys)
+
+    print(f"LLM cache: {llm_cache.stats.summary()}")
+    metrics.print_summary(group_by="document")
+    metrics.write(args.output / "metrics.json")
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,113 @@
+import re
+import zlib
+from collections import Counter, defaultdict
+
+import numpy as np
+
+# MinHash/LSH near-duplicate detection for generated (question, answer) pairs
+
+# Mersenne prime 2^31 - 1 keeps a * crc32 + b inside uint64 without overflow
+prime = np.uint64((1 << 31) - 1)
+
+
+def shingles(text, size=3):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < size:
+        return {" ".join(words)} if words else set()
+
+    return {" ".join(words[n : n + size]) for n in range(len(words) - size + 1)}
+
+
+class MinHasher:
+    def __init__(self, num_perm=128, seed=1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.a = rng.integers(1, int(prime), num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, int(prime), num_perm, dtype=np.uint64)
+
+    def signature(self, text):
+        hashes = np.fromiter((zlib.crc32(s.encode()) for s in shingles(text)), dtype=np.uint64)
+        if len(hashes) == 0:
+            return np.full(self.num_perm, prime, dtype=np.uint64)
+
+        # One row per shingle, one column per permutation; the signature is each column's minimum
+        return ((np.outer(hashes, self.a) + self.b) % prime).min(axis=0)
+
+
+class NearDuplicateIndex:
+    def __init__(self, hasher, bands=32):
+        self.hasher = hasher
+        self.bands = bands
+        self.rows = hasher.num_perm // bands
+        self.buckets = [defaultdict(list) for _ in range(bands)]
+        self.signatures = []
+
+    def _band_keys(self, signature):
+        return [signature[b * self.rows : (b + 1) * self.rows].tobytes() for b in range(self.bands)]
+
+    def most_similar(self, signature):
+        # LSH: only signatures sharing at least one band are compared in full
+        candidates = set()
+        for bucket, key in zip(self.buckets, self._band_keys(signature)):
+            candidates.update(bucket.get(key, ()))
+
+        if len(candidates) == 0:
+            return 0.0
+
+        matrix = np.stack([self.signatures[c] for c in candidates])
+
+        return float((matrix == signature).mean(axis=1).max())
+
+    def add(self, signature):
+        position = len(self.signatures)
+        self.signatures.append(signature)
+        for bucket, key in zip(self.buckets, self._band_keys(signature)):
+            bucket[key].append(position)
+
+
+class Deduplicator:
+    def __init__(self, threshold=0.6, novelty_threshold=None, window=5, min_examples=5):
+        self.hasher = MinHasher()
+        self.threshold = threshold
+        # Stop a category once fewer than novelty_threshold of its last `window` examples were novel
+        self.novelty_threshold = novelty_threshold
+        self.window = window
+        self.min_examples = min_examples
+        self.indexes = defaultdict(lambda: NearDuplicateIndex(self.hasher))
+        self.history = defaultdict(list)
+        self.skipped = Counter()
+
+    def check(self, category, question, answer):
+        signature = self.hasher.signature(f"{question} {answer}")
+        index = self.indexes[category]
+
+        similarity = index.most_similar(signature)
+        novel = similarity < self.threshold
+        if novel:
+            index.add(signature)
+
+        self.history[category].append(novel)
+
+        return novel, similarity
+
+    def novelty_rate(self, category):
+        recent = self.history[category][-self.window :]
+
+        return sum(recent) / len(recent) if recent else 1.0
+
+    def stopped(self, category):
+        if self.novelty_threshold is None or len(self.history[category]) < self.min_examples:
+            return False
+
+        return self.novelty_rate(category) < self.novelty_threshold
+
+    def summary(self):
+        return {
+            category: {
+                "examples": len(history),
+                "duplicates": len(history) - sum(history),
+                "novelty_rate": self.novelty_rate(category),
+                "skipped": self.skipped[category],
+            }
+            for category, history in self.history.items()
+        }
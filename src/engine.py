@@ -0,0 +1,95 @@
+import asyncio
+import random
+import time
+
+from metrics import current_call, new_call_record
+
+# Concurrency, rate limiting and retries for async model calls
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens=1):
+        async with self.lock:
+            self._refill()
+            while self.tokens < tokens:
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+                self._refill()
+
+            self.tokens -= tokens
+
+
+def is_throttle(exception):
+    text = f"{type(exception).__name__} {exception}"
+
+    return any(marker in text for marker in ["Throttling", "TooManyRequests", "ServiceUnavailable", "429"])
+
+
+def is_transient(exception):
+    # Throttling and connection failures pass; anything else (validation, access, a bug in our own
+    # code) fails the same way however often it's retried, so it surfaces at once
+    if isinstance(exception, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return True
+
+    name = type(exception).__name__
+    transient_names = ["EndpointConnectionError", "ConnectTimeout", "ReadTimeout", "ModelNotReady", "InternalServer"]
+
+    return is_throttle(exception) or any(marker in name for marker in transient_names)
+
+
+async def with_retry(fn, retries=5, base_delay=1.0, max_delay=30.0, on_retry=None, retryable=is_transient):
+    for attempt in range(retries + 1):
+        try:
+            return await fn()
+        except Exception as e:
+            if attempt == retries or not retryable(e):
+                raise
+
+            if on_retry is not None:
+                on_retry()
+
+            # "Full jitter" backoff, so throttled callers don't retry in lockstep
+            delay = random.uniform(0, min(max_delay, base_delay * 2**attempt))
+            await asyncio.sleep(delay)
+
+
+class Engine:
+    def __init__(self, concurrency=8, requests_per_second=None, retries=5):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.rate_limiter = TokenBucket(requests_per_second) if requests_per_second else None
+        self.retries = retries
+
+    async def _attempt(self, fn, record):
+        start = time.perf_counter()
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire()
+
+        async with self.semaphore:
+            record["queue_seconds"] += time.perf_counter() - start
+            return await fn()
+
+    async def call(self, fn, tags=None):
+        record = new_call_record(tags)
+        token = current_call.set(record)
+
+        def on_retry():
+            record["retries"] += 1
+
+        try:
+            return await with_retry(lambda: self._attempt(fn, record), retries=self.retries, on_retry=on_retry)
+        except Exception:
+            record["error"] = True
+            raise
+        finally:
+            current_call.reset(token)
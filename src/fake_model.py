@@ -0,0 +1,167 @@
+import asyncio
+import hashlib
+import re
+import threading
+import time
+import zlib
+from typing import Any, Callable, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from metrics import content_text
+from retrieval import estimate_tokens
+
+# Deterministic local stand-in for ChatBedrock, for running pipelines offline
+
+
+def message_text(messages):
+    return "\n".join(content_text(message.content) for message in messages)
+
+
+def cacheable_prefix(messages):
+    # Everything up to and including the last block marked cache_control, which is what a provider caches
+    parts = []
+    prefix = None
+    for message in messages:
+        content = message.content
+        blocks = [{"type": "text", "text": content}] if isinstance(content, str) else content
+        for block in blocks:
+            parts.append(f"{message.type}:{content_text([block])}")
+            if isinstance(block, dict) and block.get("cache_control"):
+                prefix = "\x00".join(parts)
+
+    return prefix
+
+
+class PrefixCache:
+    # Stand-in for provider-side prompt caching: a prefix is only read back if it's byte-identical
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.prefixes = set()
+        self.reads = 0
+        self.writes = 0
+        self.input_tokens = 0
+        self.read_tokens = 0
+
+    def usage(self, messages, content):
+        input_tokens = sum(estimate_tokens(content_text(message.content)) for message in messages)
+        output_tokens = estimate_tokens(content)
+        cache_read = cache_write = 0
+
+        prefix = cacheable_prefix(messages)
+        if prefix is not None:
+            digest = hashlib.sha256(prefix.encode()).hexdigest()
+            prefix_tokens = min(input_tokens, estimate_tokens(prefix))
+            with self.lock:
+                if digest in self.prefixes:
+                    self.reads += 1
+                    cache_read = prefix_tokens
+                else:
+                    self.prefixes.add(digest)
+                    self.writes += 1
+                    cache_write = prefix_tokens
+        with self.lock:
+            self.input_tokens += input_tokens
+            self.read_tokens += cache_read
+
+        # As Bedrock reports it: input_tokens are only the tokens billed fresh
+        return {
+            "input_tokens": input_tokens - cache_read - cache_write,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+            "input_token_details": {"cache_read": cache_read, "cache_creation": cache_write},
+        }
+
+    def summary(self):
+        return {
+            "prefixes": len(self.prefixes),
+            "reads": self.reads,
+            "writes": self.writes,
+            "read_fraction": self.read_tokens / self.input_tokens if self.input_tokens else 0.0,
+        }
+
+
+class FakeChatModel(BaseChatModel):
+    respond: Callable[[list], str]
+    # Time to first token, then per output token, to mimic a real endpoint's latency profile
+    latency: float = 0.0
+    seconds_per_token: float = 0.0
+    # Pads responses with filler after the real content, like a model that keeps talking
+    output_tokens: int = 0
+    # Reports usage with prompt cache reads and writes, as a provider with prompt caching would
+    prefix_cache: Optional[Any] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _content(self, messages):
+        content = self.respond(messages)
+
+        padding = self.output_tokens - estimate_tokens(content)
+        if padding > 0:
+            content += "\n" + " ".join(["etc"] * padding)
+
+        return content
+
+    def _usage(self, messages, content):
+        return self.prefix_cache.usage(messages, content) if self.prefix_cache is not None else None
+
+    def _result(self, messages, content):
+        message = AIMessage(content=content, usage_metadata=self._usage(messages, content))
+
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        content = self._content(messages)
+        time.sleep(self.latency + self.seconds_per_token * estimate_tokens(content))
+
+        return self._result(messages, content)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        content = self._content(messages)
+        await asyncio.sleep(self.latency + self.seconds_per_token * estimate_tokens(content))
+
+        return self._result(messages, content)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        content = self._content(messages)
+        await asyncio.sleep(self.latency)
+
+        for chunk in re.findall(r"\S+\s*|\s+", content):
+            await asyncio.sleep(self.seconds_per_token * estimate_tokens(chunk))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=chunk))
+
+        # Usage arrives with the last chunk, as it does from Bedrock
+        usage = self._usage(messages, content)
+        if usage is not None:
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=usage))
+
+
+def fake_generation_response(messages):
+    # Answers with a sentence from the supplied <text>, chosen by hashing the prompt so reruns match
+    text = message_text(messages)
+    # In the cached layout the document leads in a <document> block; otherwise the last <text> block is
+    # the document and earlier ones belong to the prompt's example
+    leading = re.search(r"<document>(.+?)</document>", text, re.DOTALL)
+    documents = re.findall(r"<text>(.*?)</text>", text, re.DOTALL)
+    document = leading.group(1) if leading else documents[-1] if documents else text
+    sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+", document) if s.strip()]
+    sentence = sentences[zlib.crc32(text.encode()) % len(sentences)] if sentences else "No text supplied."
+
+    page_label = re.findall(r"\[Page (\d+)\]", document)
+    page = page_label[0] if page_label else "1"
+    question = f"What does the report say about {' '.join(sentence.split()[:6])}?"
+
+    wants_answer = "<answer></answer> tags" in text
+    wants_question = "<question></question> tags" in text
+
+    parts = []
+    if wants_answer:
+        parts += [f"<answer>{sentence}</answer>", f"<page>{page}</page>"]
+    if wants_question:
+        parts += [f"<question>{question}</question>"]
+
+    return "\n".join(parts)
@@ -0,0 +1,217 @@
+import argparse
+import asyncio
+import csv
+import json
+import re
+from collections import defaultdict
+from pathlib import Path
+
+from tqdm import tqdm
+
+from engine import Engine
+from main import build_grader_prompt, load_model
+
+# Grades a RAG system's answers against the generated eval set, several answers per grader call
+
+correctness_pattern = re.compile(r"<correctness>\s*(.*?)\s*</correctness>", re.DOTALL | re.IGNORECASE)
+result_pattern = re.compile(r'<result id="(\d+)">(.*?)</result>', re.DOTALL | re.IGNORECASE)
+
+
+def build_rubric(example):
+    return f"""The question asked was: {example["question"]}
+    A correct answer must state the same facts as this reference answer, without contradicting it: {example["answer"]}"""
+
+
+def build_batch_grader_prompt(answers, rubric):
+    answers_xml = "\n".join(f'<answer id="{n}">{answer}</answer>' for n, answer in enumerate(answers, start=1))
+    user_content = f"""You will be provided several answers that assistants gave to the same question, and a rubric that instructs you on what makes an answer correct or incorrect.
+
+    Here are the answers, each with an id.
+    {answers_xml}
+
+    Here is the rubric on what makes an answer correct or incorrect.
+    <rubric>{rubric}</rubric>
+
+    An answer is correct if it entirely meets the rubric criteria, and is otherwise incorrect. Grade every answer independently of the others.
+    For each answer, output a <result id="..."></result> block with the answer's id. Inside it, first think through whether the answer is correct or incorrect based on the rubric inside <thinking></thinking> tags. Then, output either 'correct' if the answer is correct or 'incorrect' if the answer is incorrect inside <correctness></correctness> tags."""
+
+    messages = [{"role": "user", "content": user_content}]
+    return messages
+
+
+def parse_correctness(text):
+    match = correctness_pattern.search(text)
+    if match is None:
+        return None
+
+    return match.group(1).lower() == "correct"
+
+
+def parse_batch_correctness(text):
+    return {int(n): parse_correctness(body) for n, body in result_pattern.findall(text)}
+
+
+def load_rows(path):
+    path = Path(path)
+    if path.suffix == ".csv":
+        with path.open(newline="") as f:
+            return list(csv.DictReader(f))
+
+    if path.suffix == ".jsonl":
+        with path.open() as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    return json.loads(path.read_text())
+
+
+def example_key(row):
+    return row["category"], int(row["i"])
+
+
+def pack(candidates, examples, batch_size):
+    # Answers to the same eval example share a rubric, so they can be graded in one call
+    groups = defaultdict(list)
+    for candidate in candidates:
+        groups[example_key(candidate)].append(candidate)
+
+    batches = []
+    for key, group in groups.items():
+        rubric = build_rubric(examples[key])
+        for start in range(0, len(group), batch_size):
+            batches.append((rubric, group[start : start + batch_size]))
+
+    return batches
+
+
+async def agrade_one(engine, model, answer, rubric):
+    messages = build_grader_prompt(answer=answer, rubric=rubric)
+    response = await engine.call(lambda: model.ainvoke(input=messages))
+
+    return parse_correctness(response.content)
+
+
+async def agrade_batch(engine, model, rubric, candidates):
+    if len(candidates) == 1:
+        return [await agrade_one(engine, model, candidates[0]["answer"], rubric)]
+
+    messages = build_batch_grader_prompt(answers=[c["answer"] for c in candidates], rubric=rubric)
+    response = await engine.call(lambda: model.ainvoke(input=messages))
+    grades = parse_batch_correctness(response.content)
+
+    # Anything the packed response didn't grade cleanly is retried on its own
+    results = []
+    for n, candidate in enumerate(candidates, start=1):
+        grade = grades.get(n)
+        if grade is None:
+            grade = await agrade_one(engine, model, candidate["answer"], rubric)
+        results.append(grade)
+
+    return results
+
+
+async def agrade(candidates, examples, model, batch_size=4, concurrency=8, requests_per_second=None):
+    engine = Engine(concurrency=concurrency, requests_per_second=requests_per_second)
+    batches = pack(candidates=candidates, examples=examples, batch_size=batch_size)
+    progress = tqdm(desc="Grading answers", total=len(candidates))
+
+    async def run(rubric, group):
+        grades = await agrade_batch(engine=engine, model=model, rubric=rubric, candidates=group)
+        progress.update(len(group))
+
+        return [{**candidate, "correct": grade} for candidate, grade in zip(group, grades)]
+
+    graded = await asyncio.gather(*[run(rubric, group) for rubric, group in batches])
+    progress.close()
+
+    return [row for group in graded for row in group]
+
+
+def accuracy_by_category(graded):
+    totals = defaultdict(lambda: {"correct": 0, "incorrect": 0, "ungraded": 0})
+    for row in graded:
+        outcome = {True: "correct", False: "incorrect", None: "ungraded"}[row["correct"]]
+        totals[row["category"]][outcome] += 1
+        totals["all"][outcome] += 1
+
+    summary = {}
+    for category, counts in totals.items():
+        graded_count = counts["correct"] + counts["incorrect"]
+        summary[category] = {**counts, "accuracy": counts["correct"] / graded_count if graded_count else None}
+
+    return summary
+
+
+def fake_grader_response(messages):
+    # Marks an answer correct when it shares most of its words with the rubric's reference answer
+    from fake_model import message_text
+
+    text = message_text(messages)
+    rubric = re.search(r"<rubric>(.*?)</rubric>", text, re.DOTALL).group(1)
+    reference = set(re.findall(r"\w+", rubric.split("reference answer", 1)[-1].lower()))
+
+    def grade(answer):
+        words = set(re.findall(r"\w+", answer.lower()))
+        overlap = len(words & reference) / max(1, len(words))
+        return "correct" if overlap >= 0.5 else "incorrect"
+
+    answers = re.findall(r'<answer id="(\d+)">(.*?)</answer>', text, re.DOTALL)
+    if len(answers) == 0:
+        answer = re.search(r"<answer>(.*?)</answer>", text, re.DOTALL).group(1)
+        return f"<thinking>Compared with the reference.</thinking><correctness>{grade(answer)}</correctness>"
+
+    return "\n".join(
+        f'<result id="{n}"><thinking>Compared with the reference.</thinking>'
+        f"<correctness>{grade(answer)}</correctness></result>"
+        for n, answer in answers
+    )
+
+
+def _main():
+    output_dir = Path(__file__).parents[1] / "output"
+
+    parser = argparse.ArgumentParser(description="Grade candidate answers against the generated eval set")
+    parser.add_argument("answers", type=Path, help="CSV/JSON/JSONL of candidate answers with category, i and answer")
+    parser.add_argument("--eval", type=Path, default=output_dir / "eval.json", help="Generated eval set")
+    parser.add_argument("--output", type=Path, default=output_dir / "grades")
+    parser.add_argument("--batch-size", type=int, default=4, help="Answers packed into one grader call")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests-per-second", type=float, default=2)
+    parser.add_argument("--fake", action="store_true", help="Grade with a local fake model, offline")
+    args = parser.parse_args()
+
+    examples = {example_key(row): row for row in load_rows(args.eval)}
+    candidates = [row for row in load_rows(args.answers) if example_key(row) in examples]
+
+    if args.fake:
+        from fake_model import FakeChatModel
+
+        model = FakeChatModel(respond=fake_grader_response)
+    else:
+        model = load_model(cache_llm=False)
+
+    graded = asyncio.run(
+        agrade(
+            candidates=candidates,
+            examples=examples,
+            model=model,
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+            requests_per_second=args.requests_per_second,
+        )
+    )
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    with (args.output / "grades.jsonl").open("w") as f:
+        for row in graded:
+            f.write(json.dumps(row, default=str) + "\n")
+
+    summary = accuracy_by_category(graded)
+    (args.output / "accuracy.json").write_text(json.dumps(summary, indent=2))
+
+    for category, counts in summary.items():
+        accuracy = "n/a" if counts["accuracy"] is None else f"{counts['accuracy']:.1%}"
+        print(f"{category:30} {accuracy:>7} ({counts['correct']}/{counts['correct'] + counts['incorrect']})")
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,161 @@
+import csv
+import json
+from pathlib import Path
+
+# Append-only JSONL journal of generated examples, so a long run can crash and resume
+
+
+def result_key(result):
+    return result["category"], result["i"]
+
+
+class Journal:
+    def __init__(self, path, resume=True, settings=None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.settings_path = self.path.with_name(f"{self.path.name}.settings.json")
+
+        if not resume:
+            self.path.unlink(missing_ok=True)
+            self.settings_path.unlink(missing_ok=True)
+
+        if settings is not None:
+            self._check_settings(settings)
+
+        self._file = None
+
+    def _check_settings(self, settings):
+        # Results are keyed only by (category, i), so resuming under another document or prompt settings
+        # would silently mix their rows into this run's outputs
+        settings = json.loads(json.dumps(settings, default=str))
+        if self.path.exists() and self.path.stat().st_size > 0:
+            saved = json.loads(self.settings_path.read_text()) if self.settings_path.exists() else None
+            if saved != settings:
+                raise ValueError(
+                    f"{self.path} was written with different settings ({saved} vs {settings}); "
+                    "start it afresh with --no-resume"
+                )
+
+        self.settings_path.write_text(json.dumps(settings))
+
+    def __iter__(self):
+        if not self.path.exists():
+            return
+
+        with self.path.open() as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line may be cut short by a crash mid-write
+                    continue
+
+    def completed(self):
+        return {result_key(result) for result in self}
+
+    def append(self, result):
+        if self._file is None:
+            # Start on a fresh line if a crash left the last record cut short
+            needs_newline = False
+            if self.path.exists() and self.path.stat().st_size > 0:
+                with self.path.open("rb") as f:
+                    f.seek(-1, 2)
+                    needs_newline = f.read(1) != b"\n"
+
+            self._file = self.path.open("a")
+            if needs_newline:
+                self._file.write("\n")
+
+        self._file.write(json.dumps(result, default=str) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _offsets(self):
+        # One pass to find the latest line for each (category, i) and every column seen
+        offsets = {}
+        fieldnames = {}
+
+        with self.path.open("rb") as f:
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+                offsets[result_key(result)] = offset
+                fieldnames.update(dict.fromkeys(result))
+
+        return offsets, list(fieldnames)
+
+    def iter_ordered(self, keys=None, where=None):
+        # Yields results in `keys` order (or journal order), reading one line at a time
+        offsets, _ = self._offsets()
+        keys = offsets.keys() if keys is None else [key for key in keys if key in offsets]
+
+        with self.path.open("rb") as f:
+            for key in keys:
+                f.seek(offsets[key])
+                result = json.loads(f.readline())
+                if where is None or where(result):
+                    yield result
+
+    def fieldnames(self):
+        return self._offsets()[1]
+
+
+def write_csv(journal, output_file, keys=None, where=None):
+    with open(output_file, "w", newline="") as f:
+        writer = csv.DictWriter(
+            f,
+            fieldnames=journal.fieldnames(),
+            quoting=csv.QUOTE_ALL,
+            restval="",
+        )
+        writer.writeheader()
+        for result in journal.iter_ordered(keys=keys, where=where):
+            writer.writerow(result)
+
+
+def write_json(journal, output_file, keys=None, where=None):
+    with open(output_file, "w") as f:
+        f.write("[")
+        for n, result in enumerate(journal.iter_ordered(keys=keys, where=where)):
+            if n > 0:
+                f.write(",")
+            f.write(json.dumps(result, default=str))
+        f.write("]")
+
+
+def write_parquet(journal, output_file, keys=None, where=None, batch_size=1000):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Parquet output needs pyarrow: pip install pyarrow") from e
+
+    fieldnames = journal.fieldnames()
+    schema = pa.schema([(name, pa.string()) for name in fieldnames])
+
+    def to_batch(rows):
+        columns = {name: [None if row.get(name) is None else str(row[name]) for row in rows] for name in fieldnames}
+        return pa.RecordBatch.from_pydict(columns, schema=schema)
+
+    with pq.ParquetWriter(output_file, schema) as writer:
+        rows = []
+        for result in journal.iter_ordered(keys=keys, where=where):
+            rows.append(result)
+            if len(rows) == batch_size:
+                writer.write_batch(to_batch(rows))
+                rows = []
+
+        if rows:
+            writer.write_batch(to_batch(rows))
@@ -0,0 +1,258 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+
+from metrics import mark_cache_hit
+
+# Two-tier LLM response cache: an in-process LRU in front of a WAL-mode SQLite store
+
+
+def cache_key(prompt, llm_string):
+    # Whitespace-only differences in a prompt (indentation of the f-string templates) share an entry.
+    # llm_string carries the model id and kwargs, so changing temperature etc. is a different entry
+    # split/join is about 3x faster than a regex over a serialized prompt of a few hundred KB, and this
+    # runs on the event loop for every lookup and update
+    normalized = " ".join(prompt.split())
+
+    digest = hashlib.sha256(normalized.encode())
+    digest.update(b"\x00")
+    digest.update(llm_string.encode())
+
+    return digest.hexdigest()
+
+
+class LRUStore:
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class SQLiteStore:
+    def __init__(self, database_path, ttl_seconds=None, max_bytes=None, evict_every=100):
+        self.database_path = Path(database_path)
+        self.database_path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+
+        connection = self._connection()
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+            """
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    def _connection(self):
+        # sqlite3 connections can't be shared across threads, and async lookups run in a thread pool
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.database_path, isolation_level=None, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+
+        return connection
+
+    def _expired(self, created):
+        return self.ttl_seconds is not None and time.time() - created > self.ttl_seconds
+
+    def get(self, key):
+        connection = self._connection()
+        row = connection.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+
+        value, created = row
+        if self._expired(created):
+            connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            return None
+
+        connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+
+        return value
+
+    def put(self, key, value):
+        now = time.time()
+        self._connection().execute(
+            "INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+            (key, value, len(value), now, now),
+        )
+
+        with self._writes_lock:
+            self._writes += 1
+            evict = self._writes % self.evict_every == 0
+
+        if evict:
+            self.evict()
+
+    def evict(self):
+        connection = self._connection()
+
+        if self.ttl_seconds is not None:
+            connection.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl_seconds,))
+
+        if self.max_bytes is not None:
+            (total,) = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+            if total > self.max_bytes:
+                # Drop least recently used entries until the store is back under budget: every entry whose
+                # older entries don't yet add up to the excess, including the one that crosses it
+                connection.execute(
+                    """
+                    DELETE FROM responses WHERE key IN (
+                        SELECT key FROM (
+                            SELECT key, size, SUM(size) OVER (ORDER BY accessed ASC) AS running
+                            FROM responses
+                        ) WHERE running - size < ?
+                    )
+                    """,
+                    (total - self.max_bytes,),
+                )
+
+    def clear(self):
+        self._connection().execute("DELETE FROM responses")
+
+
+class CacheStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lookup_seconds = 0.0
+        self.lookups = 0
+
+    def record(self, outcome, seconds):
+        with self.lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            self.lookups += 1
+            self.lookup_seconds += seconds
+
+    def summary(self):
+        with self.lock:
+            hits = self.memory_hits + self.disk_hits
+
+            return {
+                "lookups": self.lookups,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / self.lookups if self.lookups else 0.0,
+                "mean_lookup_ms": 1000 * self.lookup_seconds / self.lookups if self.lookups else 0.0,
+            }
+
+
+class TieredCache(BaseCache):
+    def __init__(self, memory=None, store=None):
+        self.memory = memory if memory is not None else LRUStore()
+        self.store = store
+        self.stats = CacheStats()
+
+    def _hit(self, outcome, start, generations):
+        self.stats.record(outcome, time.perf_counter() - start)
+        mark_cache_hit()
+
+        return generations
+
+    def _lookup_store(self, key):
+        if self.store is None:
+            return None
+
+        value = self.store.get(key)
+        if value is None:
+            return None
+
+        generations = [loads(generation) for generation in json.loads(value)]
+        self.memory.put(key, generations)
+
+        return generations
+
+    def lookup(self, prompt, llm_string):
+        start = time.perf_counter()
+        key = cache_key(prompt, llm_string)
+
+        generations = self.memory.get(key)
+        if generations is not None:
+            return self._hit("memory_hits", start, generations)
+
+        generations = self._lookup_store(key)
+        if generations is not None:
+            return self._hit("disk_hits", start, generations)
+
+        self.stats.record("misses", time.perf_counter() - start)
+
+        return None
+
+    async def alookup(self, prompt, llm_string):
+        start = time.perf_counter()
+        key = cache_key(prompt, llm_string)
+
+        # Memory hits stay on the event loop; only the disk tier is pushed to a thread
+        generations = self.memory.get(key)
+        if generations is not None:
+            return self._hit("memory_hits", start, generations)
+
+        generations = await asyncio.to_thread(self._lookup_store, key)
+        if generations is not None:
+            return self._hit("disk_hits", start, generations)
+
+        self.stats.record("misses", time.perf_counter() - start)
+
+        return None
+
+    def _serialize(self, return_val):
+        return json.dumps([dumps(generation) for generation in return_val])
+
+    def update(self, prompt, llm_string, return_val):
+        key = cache_key(prompt, llm_string)
+        self.memory.put(key, return_val)
+        if self.store is not None:
+            self.store.put(key, self._serialize(return_val))
+
+    async def aupdate(self, prompt, llm_string, return_val):
+        key = cache_key(prompt, llm_string)
+        self.memory.put(key, return_val)
+        if self.store is not None:
+            await asyncio.to_thread(self.store.put, key, self._serialize(return_val))
+
+    def clear(self, **kwargs):
+        self.memory.clear()
+        if self.store is not None:
+            self.store.clear()
@@ -1,18 +1,34 @@
-import csv
-import re
+import argparse
+import asyncio
+import time
+from collections import Counter
 from pathlib import Path
 from pprint import pprint
 
-import boto3
-import pandas as pd
-import xmltodict
-from langchain_aws import ChatBedrock
-from langchain_community.cache import SQLiteCache
-from langchain_core.globals import set_llm_cache
 from langchain_core.messages.human import HumanMessage
 from langchain_core.messages.system import SystemMessage
 from tqdm import tqdm
 
+import pdf_loader
+from categories import load_categories
+from engine import Engine
+from journal import Journal, write_csv, write_json, write_parquet
+from metrics import InstrumentedChatModel, Metrics, content_text
+from retrieval import BM25Index, estimate_tokens, format_pages
+from streaming import astream_until_tags, find_tag
+
+# Categories whose answers need facts from more than one part of the document
+cross_page_categories = {
+    "split_true_fact",
+    "key_metric",
+    "evolving_fact",
+    "cross_reference",
+    "key_metrics_time_periods",
+    "counterintuitive",
+}
+
+# Responses whose required tag couldn't be parsed, by tag, for the whole run
+parse_failure_counts = Counter()
 
 def build_grader_prompt(answer, rubric):
     user_content = f"""You will be provided an answer that an assistant gave to a question, and a rubric that instructs you on what makes the answer correct or incorrect.
@@ -36,9 +52,27 @@ def build_grader_prompt(answer, rubric):
     # </example>
 
 
-def answer_message(i, instruction, text) -> HumanMessage:
-    message = HumanMessage(
-        content=f"""{i}.
+# In the cached layout the document leads the message, so the prompt refers back to it
+document_reference = "<text>The text inside the <document></document> tags above.</text>"
+
+
+def layout_message(prompt, text, cache_prefix=False) -> HumanMessage:
+    if not cache_prefix:
+        return HumanMessage(content=prompt)
+
+    # The document goes first, in its own block marked cacheable, so every call over the same text sends a
+    # byte-identical prefix the provider can serve from its prompt cache; the index and instruction follow it
+    return HumanMessage(
+        content=[
+            {"type": "text", "text": f"<document>{text}</document>", "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": prompt},
+        ]
+    )
+
+
+def answer_message(i, instruction, text, cache_prefix=False) -> HumanMessage:
+    text_xml = document_reference if cache_prefix else f"<text>{text}</text>"
+    prompt = f"""{i}.
         You will be provided an instruction for you to follow and some text to analyse. 
         You will generate an answer that follows the instruction for this text and the page numbers(s) within the text that you found it.
 
@@ -55,18 +89,17 @@ def answer_message(i, instruction, text) -> HumanMessage:
         Given this example, here is a user generated instruction and text to generate an answer for:
 
         <instruction>{instruction}</instruction>
-        <text>{text}</text>
+        {text_xml}
 
         Based on the guidelines above, generate an answer within <answer></answer> tags and page within <page></page> tags. Include only the actual answer, do not include the instruction or any preamble within the question.
     """
-    )
 
-    return message
+    return layout_message(prompt=prompt, text=text, cache_prefix=cache_prefix)
 
 
-def question_message(i, text, answer) -> HumanMessage:
-    message = HumanMessage(
-        content=f"""{i}
+def question_message(i, text, answer, cache_prefix=False) -> HumanMessage:
+    text_xml = document_reference if cache_prefix else f"<text>{text}</text>"
+    prompt = f"""{i}
         You will be given an answer and text.
         You will generate an question that would naturally lead to this answer for the supplied text.
 
@@ -80,156 +113,552 @@ def question_message(i, text, answer) -> HumanMessage:
 
         Given this example, here is a user generated instruction text and answer to generate a question for:
 
-        <text>{text}</text>
+        {text_xml}
         <answer>{answer}</answer>
 
         Based on the guidelines above, generate a question within <question></question> tags. Include only the actual question, do not include the instruction, answer or any preamble within the question.
     """
-    )
 
-    return message
+    return layout_message(prompt=prompt, text=text, cache_prefix=cache_prefix)
+
+
+def combined_message(i, instruction, text, cache_prefix=False) -> HumanMessage:
+    text_xml = document_reference if cache_prefix else f"<text>{text}</text>"
+    prompt = f"""{i}.
+        You will be provided an instruction for you to follow and some text to analyse.
+        You will generate an answer that follows the instruction for this text and the page numbers(s) within the text that you found it.
+        You will then generate a question that would naturally lead to this answer for the supplied text.
+
+        Here is an example:
+
+        <example>
+            <instruction>Find an obscure economic observation that is unique to this document.</instruction>
+            <text>The Ninth Circuit overruled Berkeley’s natural gas ban in new buildings after concluding that it conflicts with Federal law; the impact of this decision could be material.  Natural gas is cheaper than electricity per unit of energy, offsetting heat pump efficiency benefits for homeowners</text>
+            <page>2</page>
+
+            <answer>Natural gas is a better choice for US states, even if they have regulation that opposes it.</answer>
+            <question>If legal protection is in place, should a state still push for a particular energy generation approach?</question>
+        </example>
+
+        Given this example, here is a user generated instruction and text to generate an answer and question for:
+
+        <instruction>{instruction}</instruction>
+        {text_xml}
+
+        Based on the guidelines above, generate an answer within <answer></answer> tags, page within <page></page> tags and a question within <question></question> tags. Include only the actual answer and question, do not include the instruction or any preamble within them.
+    """
+
+    return layout_message(prompt=prompt, text=text, cache_prefix=cache_prefix)
+
+
+def missing_tags(xml, tags):
+    return [tag for tag in tags if find_tag(xml, tag) is None]
+
+
+def record_usage(usage, messages, response_xml, tags):
+    if usage is None:
+        return
+
+    usage["input_tokens"] += sum(estimate_tokens(content_text(message.content)) for message in messages)
+    usage["output_tokens"] += estimate_tokens(response_xml)
+    usage["parse_failures"] += len(missing_tags(response_xml, tags))
+
+
+def parse_tag(xml, tag):
+    value = find_tag(xml, tag)
+    if value is None:
+        parse_failure_counts[tag] += 1
+        return xml
+
+    return value
+
+
+def parse_question(question_xml):
+    return parse_tag(question_xml, "question")
+
+
+def parse_answer(answer_xml):
+    return parse_tag(answer_xml, "answer"), parse_tag(answer_xml, "page")
+
+
+async def acomplete(model, messages, tags, stream=False):
+    if stream:
+        return await astream_until_tags(model=model, messages=messages, tags=tags)
+
+    return (await model.ainvoke(input=messages)).content
 
 
 def generate_question(i, model, system_message, answer, text):
     messages = [system_message, question_message(i=i, text=text, answer=answer)]
     question_xml = model.invoke(input=messages).content
-    # question = xmltodict.parse(question_xml)["question"]
-    try:
-        question = re.findall(r"<question>(.*)</question>", question_xml)[0]
-    except:
-        question = question_xml
 
-    return question
+    return parse_question(question_xml)
 
 
 def generate_answer(i, model, system_message, instruction, text):
     messages = [system_message, answer_message(i=i, instruction=instruction, text=text)]
     answer_xml = model.invoke(input=messages).content
-    # answer_dict = xmltodict.parse(answer_xml)
-    try:
-        answer = re.findall(r"<answer>(.*)</answer>", answer_xml)[0]
-    except:
-        answer = answer_xml
 
-    try:
-        page = re.findall(r"<page>(.*)</page>", answer_xml)[0]
-    except:
-        page = answer_xml
+    return parse_answer(answer_xml)
 
-    return answer, page
 
+async def agenerate_question(i, model, system_message, answer, text, usage=None, stream=False, cache_prefix=False):
+    messages = [system_message, question_message(i=i, text=text, answer=answer, cache_prefix=cache_prefix)]
+    question_xml = await acomplete(model, messages, tags=["question"], stream=stream)
+    record_usage(usage, messages, question_xml, tags=["question"])
 
-def _main():
-    cache_path = Path(__file__).parent / ".langchain.db"
-    # if cache_path.exists():
-    #     cache_path.unlink()
+    return parse_question(question_xml)
 
-    set_llm_cache(SQLiteCache(database_path=cache_path))
-    cache_llm = True
-    n = 1
-
-    text = load_doc()
-
-    evaluation_category_prompts = {
-        "single_true_fact": "Find a single significant fact that a Financial Analyst would find significant, that only appears once in the document.",
-        "single_false_fact": "Make up a single fact that a Financial Analysit would normally be looking for, but it definitely must not appear in the document.",
-        "split_true_fact": "Find a significant fact that a Financial Analyst would find important, where that fact is only apparent when considering two different pages of the document. The fact must not be apparent when looking at just one page.",
-        "key_metric": "Identify a key financial metric or trend by comparing data points across different sections of the document.  ",
-        "contradiction": "Search for a statistic or data point that contradicts a commonly held assumption or conventional wisdom within the financial industry.  ",
-        "evolving_fact": "Identify a key financial metric or trend that is mentioned across multiple sections of the document, and analyze how it evolves or is contextualized differently in each section.  ",
-        "executive_summary": "Carefully read the Executive Summary as it provides a snapshot of the entire report.  Note down any highlighted trends, major findings, and significant conclusions presented in this section.",
-        "economic_indicators": "Locate the section discussing economic indicators (e.g., GDP growth rates, inflation, employment data).  Write down the current values and any changes compared to previous periods, as well as any analysis provided on how these indicators are impacting the market.",
-        "sector_performance": "Focus on the Sector Analysis section to determine how different sectors are performing.  Identify the best-performing and worst-performing sectors, noting any specific reasons or factors mentioned for their performance.",
-        "forward_looking_statements": "Pay attention to the Future Outlook or Projections sections towards the end of the report.  Extract key forecasts, expectations, and any strategic recommendations or anticipated challenges that could influence future market conditions.",
-        "geopolitical_factors": "Identify any geopolitical events or conditions discussed in the document that are influencing the market, and summarize their potential impact.",
-        "investment_sentiment": "Assess and summarize the overall market sentiment towards investment, including any shifts in investor confidence or behavior highlighted in the report.",
-        "risk_factor": "Identify a key risk factor or economic trend that could significantly impact the financial institution's performance or outlook, by carefully examining sections discussing macroeconomic conditions, regulatory changes, and industry dynamics.",
-        "cross_reference": "Carefully cross-reference data points across multiple sections of the document to uncover non-obvious trends, discrepancies or interconnected insights that may not be evident from a cursory review.",
-        "key_metrics_time_periods": "Identify key financial metrics or trends by carefully comparing data across multiple time periods within the document.",
-        "counterintuitive": "Find a counterintuitive or unexpected fact that contradicts conventional wisdom by carefully analyzing data and trends across multiple sections of the financial report.",
-    }
 
-    results = []
+async def agenerate_answer(i, model, system_message, instruction, text, usage=None, stream=False, cache_prefix=False):
+    messages = [system_message, answer_message(i=i, instruction=instruction, text=text, cache_prefix=cache_prefix)]
+    answer_xml = await acomplete(model, messages, tags=["answer", "page"], stream=stream)
+    record_usage(usage, messages, answer_xml, tags=["answer", "page"])
+
+    return parse_answer(answer_xml)
 
-    system_message = SystemMessage(
-        """
-            You are a financial analyst who deeply reviews Financial Market Reports.
-        """,
-    )
-    model = load_model(cache_llm=cache_llm)
 
-    progress = tqdm("Generating examples", total=len(evaluation_category_prompts) * n)
+async def agenerate_combined(i, model, system_message, instruction, text, usage=None, stream=False, cache_prefix=False):
+    messages = [system_message, combined_message(i=i, instruction=instruction, text=text, cache_prefix=cache_prefix)]
+    combined_xml = await acomplete(model, messages, tags=["answer", "page", "question"], stream=stream)
+    record_usage(usage, messages, combined_xml, tags=["answer", "page", "question"])
 
-    for category, instruction in evaluation_category_prompts.items():
-        for i in range(n):
-            progress.set_description_str(f"{i+1}/{n}:{category}")
+    answer, page = parse_answer(combined_xml)
 
-            answer, page = generate_answer(
+    return answer, page, parse_question(combined_xml)
+
+
+async def agenerate_example(
+    engine,
+    i,
+    category,
+    instruction,
+    model,
+    system_message,
+    text,
+    combined=False,
+    stream=False,
+    cache_prefix=False,
+    document=None,
+):
+    usage = Counter(input_tokens=0, output_tokens=0, parse_failures=0)
+    start = time.perf_counter()
+
+    def tags(step):
+        tags = {"category": category, "i": i, "step": step}
+        if document is not None:
+            tags["document"] = document
+
+        return tags
+
+    if combined:
+        answer, page, question = await engine.call(
+            lambda: agenerate_combined(
                 i=i,
                 model=model,
                 system_message=system_message,
                 text=text,
                 instruction=instruction,
-            )
-            question = generate_question(
+                usage=usage,
+                stream=stream,
+                cache_prefix=cache_prefix,
+            ),
+            tags=tags(step="combined"),
+        )
+    else:
+        answer, page = await engine.call(
+            lambda: agenerate_answer(
+                i=i,
+                model=model,
+                system_message=system_message,
+                text=text,
+                instruction=instruction,
+                usage=usage,
+                stream=stream,
+                cache_prefix=cache_prefix,
+            ),
+            tags=tags(step="answer"),
+        )
+        # The question call is issued as soon as this example's answer is back,
+        # without waiting for the rest of the batch
+        question = await engine.call(
+            lambda: agenerate_question(
                 i=i,
                 model=model,
                 system_message=system_message,
                 text=text,
                 answer=answer,
+                usage=usage,
+                stream=stream,
+                cache_prefix=cache_prefix,
+            ),
+            tags=tags(step="question"),
+        )
+
+    return {
+        "i": i,
+        "category": category,
+        "instruction": instruction,
+        "question": question,
+        "page": page,
+        "answer": answer,
+        "latency_seconds": time.perf_counter() - start,
+        **usage,
+    }
+
+
+async def agenerate_row(
+    engine,
+    i,
+    category,
+    instruction,
+    model,
+    system_message,
+    text,
+    pages=None,
+    index=None,
+    top_k=5,
+    combined=False,
+    stream=False,
+    cache_prefix=False,
+    document=None,
+):
+    context, context_pages = select_context(
+        category=category,
+        instruction=instruction,
+        text=text,
+        pages=pages,
+        index=index,
+        top_k=top_k,
+    )
+    result = await agenerate_example(
+        engine=engine,
+        i=i,
+        category=category,
+        instruction=instruction,
+        model=model,
+        system_message=system_message,
+        text=context,
+        combined=combined,
+        stream=stream,
+        cache_prefix=cache_prefix,
+        document=document,
+    )
+    result["context_pages"] = context_pages
+    result["context_tokens"] = estimate_tokens(context)
+
+    return result
+
+
+async def agenerate_examples(
+    evaluation_category_prompts,
+    n,
+    model,
+    system_message,
+    text,
+    concurrency=8,
+    requests_per_second=None,
+    retries=5,
+    pages=None,
+    index=None,
+    top_k=5,
+    journal=None,
+    combined=False,
+    stream=False,
+    cache_prefix=False,
+    verbose=True,
+    dedup=None,
+):
+    engine = Engine(
+        concurrency=concurrency,
+        requests_per_second=requests_per_second,
+        retries=retries,
+    )
+    keys = {(category, i) for category in evaluation_category_prompts for i in range(n)}
+    # Only what this run asked for; the journal may also hold other categories or a larger n
+    completed = (journal.completed() & keys) if journal is not None else set()
+    if dedup is not None and journal is not None:
+        # Replay what earlier runs generated so resumed categories dedup against it
+        for result in journal:
+            dedup.check(result["category"], result["question"], result["answer"])
+    progress = tqdm(
+        "Generating examples",
+        total=len(evaluation_category_prompts) * n,
+        initial=len(completed),
+    )
+
+    slots = asyncio.Semaphore(concurrency)
+
+    async def run(category, instruction, i):
+        async with slots:
+            if dedup is not None and dedup.stopped(category):
+                dedup.skipped[category] += 1
+                progress.update(1)
+                return None
+
+            result = await agenerate_row(
+                engine=engine,
+                i=i,
+                category=category,
+                instruction=instruction,
+                model=model,
+                system_message=system_message,
+                text=text,
+                pages=pages,
+                index=index,
+                top_k=top_k,
+                combined=combined,
+                stream=stream,
+                cache_prefix=cache_prefix,
             )
 
-            result = {
-                "i": i,
-                "category": category,
-                "instruction": instruction,
-                "question": question,
-                "page": page,
-                "answer": answer,
-            }
+        if dedup is not None:
+            novel, similarity = dedup.check(category, result["question"], result["answer"])
+            result["similarity"] = similarity
+            result["duplicate"] = not novel
+        if journal is not None:
+            journal.append(result)
+        if verbose:
+            print(result["question"])
+            print(result["answer"])
+
+        progress.set_description_str(f"{i+1}/{n}:{category}")
+        progress.update(1)
+
+        return result
+
+    # Slots are handed out in creation order, so issuing i-major queues each category's later examples
+    # behind its earlier ones, giving dedup's early stop a chance to act before they're generated
+    tasks = [
+        run(category=category, instruction=instruction, i=i)
+        for i in range(n)
+        for category, instruction in evaluation_category_prompts.items()
+        if (category, i) not in completed
+    ]
+
+    results = [result for result in await asyncio.gather(*tasks) if result is not None]
+    progress.close()
+
+    # Back to category x n order, whatever order examples completed in
+    category_order = {category: position for position, category in enumerate(evaluation_category_prompts)}
+    results.sort(key=lambda result: (category_order[result["category"]], result["i"]))
+
+    context_tokens = [result["context_tokens"] for result in results]
+    if len(completed) > 0:
+        print(f"Resumed: skipped {len(completed)} examples already in the journal")
+    print(
+        f"Document tokens per call: {sum(context_tokens) / max(1, len(context_tokens)):.0f} mean"
+        f" vs {estimate_tokens(text)} for the full document"
+    )
+    if dedup is not None:
+        skipped = sum(dedup.skipped.values())
+        print(f"Dedup: {dedup.summary()}")
+        print(f"Early stop skipped {skipped} examples, saving {skipped * (1 if combined else 2)} calls")
+
+    return results
+
+
+def select_context(category, instruction, text, pages, index, top_k):
+    if index is None:
+        return text, "all"
+
+    if category in cross_page_categories:
+        page_numbers = index.search_with_coverage(instruction, k=top_k)
+    else:
+        page_numbers = index.search(instruction, k=top_k)
 
-            results.append(result)
-            print(question)
-            print(answer)
+    if len(page_numbers) == 0:
+        return text, "all"
 
-            progress.update(1)
+    return format_pages(pages, page_numbers), ",".join(str(p) for p in sorted(page_numbers))
+
+
+def setup_llm_cache():
+    from langchain_core.globals import set_llm_cache
+
+    from llm_cache import LRUStore, SQLiteStore, TieredCache
+
+    cache_path = Path(__file__).parent / ".llm_cache.db"
+    # if cache_path.exists():
+    #     cache_path.unlink()
+
+    llm_cache = TieredCache(
+        memory=LRUStore(max_entries=1024),
+        store=SQLiteStore(
+            database_path=cache_path,
+            ttl_seconds=None,
+            max_bytes=512 * 1024 * 1024,
+        ),
+    )
+    set_llm_cache(llm_cache)
+
+    return llm_cache
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Generate the evaluation set for a document")
+    parser.add_argument("--document", type=Path, default=doc_path(), help="PDF, or text pdf_loader extracted")
+    parser.add_argument("--category", action="append", help="Only generate this category; repeatable")
+    parser.add_argument("--n", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests-per-second", type=float, default=2)
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--retrieval", action="store_true")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--no-resume", action="store_true")
+    parser.add_argument("--no-llm-cache", action="store_true")
+    parser.add_argument("--parquet", action="store_true")
+    parser.add_argument("--combined", action="store_true")
+    parser.add_argument("--stream", action="store_true")
+    # Document-first layout marked for the provider's prompt cache; needs a model with Bedrock prompt caching
+    parser.add_argument("--cache-prefix", action="store_true")
+    parser.add_argument("--region", action="append", dest="regions", help="Repeat to route across regions")
+    parser.add_argument("--dedup", action="store_true")
+    parser.add_argument("--novelty-threshold", type=float, default=0.3)
+    args = parser.parse_args()
+
+    regions = args.regions or ["ap-southeast-2"]
+
+    evaluation_category_prompts = load_categories()
+    if args.category:
+        unknown = [category for category in args.category if category not in evaluation_category_prompts]
+        if unknown:
+            parser.error(
+                f"unknown category {', '.join(unknown)}; choose from {', '.join(evaluation_category_prompts)}"
+            )
+        evaluation_category_prompts = {category: evaluation_category_prompts[category] for category in args.category}
+
+    llm_cache = setup_llm_cache()
+    input_file = args.document
+    pages = load_pages(input_file=input_file)
+    text = pdf_loader.join_pages(pages)
+    index = load_index(input_file=input_file, pages=pages) if args.retrieval else None
+
+    system_message = SystemMessage(
+        """
+            You are a financial analyst who deeply reviews Financial Market Reports.
+        """,
+    )
+    metrics = Metrics()
+    model = load_model(
+        cache_llm=not args.no_llm_cache,
+        metrics=metrics,
+        regions=regions,
+        max_pool_connections=max(10, args.concurrency),
+    )
+
+    dedup = None
+    if args.dedup:
+        from dedup import Deduplicator
+
+        dedup = Deduplicator(novelty_threshold=args.novelty_threshold)
 
     output_path = Path(__file__).parents[1] / "output"
-    output_path.mkdir(parents=True, exist_ok=True)
-    df = pd.DataFrame(data=results)
-    df.to_csv(
-        output_path / "eval.csv",
-        index=False,
-        quoting=csv.QUOTE_ALL,
-        header=True,
+    settings = generation_settings(
+        input_file=input_file,
+        retrieval=args.retrieval,
+        top_k=args.top_k,
+        combined=args.combined,
+        cache_prefix=args.cache_prefix,
     )
-    df.to_json(output_path / "eval.json", default_handler=str, orient="records")
+    try:
+        journal = Journal(output_path / "eval.journal.jsonl", resume=not args.no_resume, settings=settings)
+    except ValueError as e:
+        parser.error(str(e))
+
+    asyncio.run(
+        agenerate_examples(
+            evaluation_category_prompts=evaluation_category_prompts,
+            n=args.n,
+            model=model,
+            system_message=system_message,
+            text=text,
+            concurrency=args.concurrency,
+            requests_per_second=args.requests_per_second,
+            retries=args.retries,
+            pages=pages,
+            index=index,
+            top_k=args.top_k,
+            journal=journal,
+            combined=args.combined,
+            stream=args.stream,
+            cache_prefix=args.cache_prefix,
+            dedup=dedup,
+        )
+    )
+    journal.close()
+    print(f"LLM cache: {llm_cache.stats.summary()}")
+    print(f"Parse failures: {dict(parse_failure_counts)}")
+    metrics.print_summary()
+    if len(regions) > 1:
+        metrics.print_summary(group_by="region")
+    metrics.write(output_path / "metrics.json")
+
+    # Outputs are streamed from the journal in category x n order, so resumed runs match fresh ones
+    keys = [(category, i) for category in evaluation_category_prompts for i in range(args.n)]
+    # Near-duplicates stay in the journal, so resumes don't regenerate them, but not in the outputs
+    def where(result):
+        return not result.get("duplicate")
+
+    write_csv(journal, output_path / "eval.csv", keys=keys, where=where)
+    write_json(journal, output_path / "eval.json", keys=keys, where=where)
+    if args.parquet:
+        write_parquet(journal, output_path / "eval.parquet", keys=keys, where=where)
+
+
+def generation_settings(input_file, retrieval=False, top_k=5, combined=False, cache_prefix=False):
+    # What a journal's rows depend on beyond (category, i), so a resume can't mix in another run's rows
+    return {
+        "document": pdf_loader.file_digest(input_file),
+        "retrieval": retrieval,
+        "top_k": top_k if retrieval else None,
+        "combined": combined,
+        "cache_prefix": cache_prefix,
+    }
 
 
-def load_doc() -> str:
-    output_dir = Path(__file__).parents[1] / "output"
-    doc_dir = output_dir / "JPM Electravision 14th Annual Energy Paper 20240305.pdf.txt"
+def doc_path() -> Path:
+    data_dir = Path(__file__).parents[1] / "data"
 
-    return doc_dir.read_text()
+    return data_dir / "JPM Electravision 14th Annual Energy Paper 20240305.pdf"
 
 
-def load_model(cache_llm):
-    model = ChatBedrock(
-        client=boto3.client(
-            service_name="bedrock-runtime",
-            region_name="ap-southeast-2",
-        ),
-        model_id="anthropic.claude-3-sonnet-20240229-v1:0",
-        model_kwargs={
-            "max_tokens": 4096,
-            "temperature": 0.7,
-            "top_k": 250,
-            "top_p": 1,
-            "stop_sequences": ["\n\nHuman"],
-        },
+def load_pages(input_file=None) -> list[str]:
+    input_file = Path(input_file or doc_path())
+
+    # Already-extracted text, as written by pdf_loader, which never emits a blank line inside a page
+    if input_file.suffix == ".txt":
+        return input_file.read_text().split("\n\n")
+
+    # Resolved through the page cache, so an unchanged PDF is never re-parsed
+    return list(pdf_loader.iter_cached_pages(input_file=input_file))
+
+
+def load_doc(input_file=None) -> str:
+    return pdf_loader.join_pages(load_pages(input_file=input_file))
+
+
+def load_index(input_file, pages):
+    return BM25Index.load_or_build(
+        path=pdf_loader.default_cache_dir / f"{Path(input_file).name}.index.json",
+        pages=pages,
+    )
+
+
+def load_model(cache_llm, metrics=None, regions=None, max_pool_connections=50):
+    # boto3 and langchain_aws take about a second to import, so only paths that call a model load them
+    from bedrock import load_chat_model
+
+    # More than one region returns a router that favours the least throttled, fastest region
+    model = load_chat_model(
+        regions=regions,
         cache=cache_llm,
+        max_pool_connections=max_pool_connections,
     )
 
+    if metrics is not None:
+        model = InstrumentedChatModel(model=model, metrics=metrics)
+
     return model
 
 
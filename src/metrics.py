@@ -0,0 +1,199 @@
+import json
+import statistics
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from pathlib import Path
+
+from retrieval import estimate_tokens
+
+# Per-call latency, token, cache and retry metrics for model calls
+
+# The record for the model call in flight. Engine.call opens one per call; the model wrapper and the
+# LLM cache fill it in. It's a mutable dict so updates made in tasks langchain spawns are still seen
+current_call = ContextVar("current_call", default=None)
+
+
+def new_call_record(tags=None):
+    return {
+        **(tags or {}),
+        "wall_seconds": 0.0,
+        "queue_seconds": 0.0,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        # Input tokens the provider served from its prompt cache, and wrote to it, rather than billed fresh
+        "cache_read_tokens": 0,
+        "cache_write_tokens": 0,
+        "cache_hit": False,
+        "retries": 0,
+        "error": False,
+    }
+
+
+def mark_cache_hit():
+    record = current_call.get()
+    if record is not None:
+        record["cache_hit"] = True
+
+
+def percentile(values, q):
+    if len(values) == 0:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def content_text(content):
+    # Message content is a string, or a list of content blocks when parts of it are marked cacheable
+    if isinstance(content, str):
+        return content
+
+    return "".join(block.get("text", "") if isinstance(block, dict) else str(block) for block in content)
+
+
+def usage_tokens(message, messages):
+    # Bedrock reports real usage; cached and fake responses may not, so fall back to an estimate
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        return usage["input_tokens"], usage["output_tokens"]
+
+    usage = (getattr(message, "response_metadata", None) or {}).get("usage")
+    if usage:
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+
+    input_tokens = sum(estimate_tokens(content_text(getattr(m, "content", m))) for m in messages)
+
+    return input_tokens, estimate_tokens(content_text(message.content))
+
+
+def prompt_cache_tokens(message):
+    details = (getattr(message, "usage_metadata", None) or {}).get("input_token_details") or {}
+
+    return details.get("cache_read") or 0, details.get("cache_creation") or 0
+
+
+class Metrics:
+    def __init__(self):
+        self.records = []
+
+    def current_record(self):
+        record = current_call.get()
+        if record is None:
+            # Called outside Engine.call, e.g. the synchronous generate_* helpers
+            record = new_call_record()
+
+        if not record.get("recorded"):
+            record["recorded"] = True
+            self.records.append(record)
+
+        return record
+
+    def summary(self, group_by="category"):
+        groups = defaultdict(list)
+        for record in self.records:
+            groups[record.get(group_by, "-")].append(record)
+
+        # Totals go last so they sit at the bottom of the printed table
+        if len(self.records) > 0:
+            groups["all"] = list(self.records)
+
+        summary = {}
+        for group, records in groups.items():
+            wall = [r["wall_seconds"] for r in records]
+            queue = [r["queue_seconds"] for r in records]
+
+            summary[group] = {
+                "calls": len(records),
+                "wall_p50": percentile(wall, 50),
+                "wall_p95": percentile(wall, 95),
+                "wall_max": max(wall),
+                "queue_p50": percentile(queue, 50),
+                "queue_p95": percentile(queue, 95),
+                "input_tokens": sum(r["input_tokens"] for r in records),
+                "output_tokens": sum(r["output_tokens"] for r in records),
+                "cache_read_tokens": sum(r["cache_read_tokens"] for r in records),
+                "cache_write_tokens": sum(r["cache_write_tokens"] for r in records),
+                "cache_hit_rate": sum(r["cache_hit"] for r in records) / len(records),
+                "retries": sum(r["retries"] for r in records),
+                "errors": sum(r["error"] for r in records),
+            }
+
+        return summary
+
+    def print_summary(self, group_by="category"):
+        summary = self.summary(group_by=group_by)
+        columns = [
+            "calls",
+            "wall_p50",
+            "wall_p95",
+            "queue_p95",
+            "input_tokens",
+            "cache_read_tokens",
+            "output_tokens",
+            "cache_hit_rate",
+            "retries",
+        ]
+
+        print(f"{group_by:28}" + "".join(f"{column:>18}" for column in columns))
+        for group, row in summary.items():
+            cells = "".join(
+                f"{row[column]:>18.2f}" if isinstance(row[column], float) else f"{row[column]:>18}"
+                for column in columns
+            )
+            print(f"{str(group):28}{cells}")
+
+    def write(self, path):
+        data = {
+            "summary": self.summary(),
+            "calls": [{k: v for k, v in record.items() if k != "recorded"} for record in self.records],
+        }
+        Path(path).write_text(json.dumps(data, indent=2, default=str))
+
+
+class InstrumentedChatModel:
+    def __init__(self, model, metrics):
+        self.model = model
+        self.metrics = metrics
+
+    def _finish(self, record, start, message, messages):
+        record["wall_seconds"] += time.perf_counter() - start
+        if record["cache_hit"]:
+            # The cached message still carries the usage of the call that filled the cache
+            record["input_tokens"], record["output_tokens"] = 0, 0
+        else:
+            record["input_tokens"], record["output_tokens"] = usage_tokens(message, messages)
+            record["cache_read_tokens"], record["cache_write_tokens"] = prompt_cache_tokens(message)
+
+    def invoke(self, input, **kwargs):
+        record = self.metrics.current_record()
+        start = time.perf_counter()
+        message = self.model.invoke(input=input, **kwargs)
+        self._finish(record, start, message, input)
+
+        return message
+
+    async def ainvoke(self, input, **kwargs):
+        record = self.metrics.current_record()
+        start = time.perf_counter()
+        message = await self.model.ainvoke(input=input, **kwargs)
+        self._finish(record, start, message, input)
+
+        return message
+
+    async def astream(self, input, **kwargs):
+        record = self.metrics.current_record()
+        start = time.perf_counter()
+        message = None
+        stream = self.model.astream(input=input, **kwargs)
+
+        try:
+            async for chunk in stream:
+                message = chunk if message is None else message + chunk
+                yield chunk
+        finally:
+            # Also runs when the caller stops the stream early
+            await stream.aclose()
+            if message is not None:
+                self._finish(record, start, message, input)
@@ -1,11 +1,23 @@
-from collections import Counter
+import argparse
+import hashlib
+import json
+import os
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
 from pathlib import Path
 
-import fitz
+# fitz (PyMuPDF) is imported where it's used, so reading already-cached pages never loads it
+
+# Bump whenever parse_page changes what it emits, or page_keys what it covers, so cached pages are re-extracted
+extractor_version = "2"
+
+default_cache_dir = Path(__file__).parents[1] / "output" / "page_cache"
 
 
 def parse_page(page) -> str:
+    import fitz
+
     lines = []
 
     for b in page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]:
@@ -32,25 +44,208 @@ def parse_page(page) -> str:
     return "\n".join(lines)
 
 
-def to_markdown(input_file):
-    doc = fitz.open(input_file)
+def parse_pages(input_file, page_numbers) -> list[str]:
+    import fitz
+
+    # Runs in a worker process, so each call opens its own fitz handle
+    with fitz.open(input_file) as doc:
+        return [parse_page(doc[page_number]) for page_number in page_numbers]
+
+
+def page_chunks(page_numbers, pages_per_chunk):
+    return [
+        page_numbers[start : start + pages_per_chunk]
+        for start in range(0, len(page_numbers), pages_per_chunk)
+    ]
+
+
+def iter_pages(input_file, page_numbers=None, executor=None, workers=None, pages_per_chunk=16):
+    if page_numbers is None:
+        import fitz
+
+        with fitz.open(input_file) as doc:
+            page_numbers = list(range(doc.page_count))
+
+    chunks = page_chunks(page_numbers=page_numbers, pages_per_chunk=pages_per_chunk)
+
+    if executor is None:
+        for chunk in chunks:
+            yield from parse_pages(input_file=input_file, page_numbers=chunk)
+        return
+
+    # Keep a bounded window of chunks in flight and yield them in page order as they complete
+    window = 2 * (workers or os.cpu_count() or 1)
+    pending = deque()
+    for chunk in chunks:
+        pending.append(executor.submit(parse_pages, str(input_file), chunk))
+        if len(pending) >= window:
+            yield from pending.popleft().result()
+
+    while pending:
+        yield from pending.popleft().result()
+
+
+def file_digest(input_file):
+    digest = hashlib.sha256()
+    with open(input_file, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def page_keys(input_file) -> list[str]:
+    # A page's key covers its content stream, the Form XObjects it draws (nested ones included) and the
+    # fonts used to decode it, but not xref numbers, which a re-issued PDF renumbers even when the page
+    # itself is unchanged. Imposed or stamped pages are often just "q /fzFrm0 Do Q", with all their text
+    # in a form, so the page stream alone would give them all the same key
+    import fitz
+
+    keys = []
+    with fitz.open(input_file) as doc:
+        for page in doc:
+            digest = hashlib.sha256(extractor_version.encode())
+            digest.update(page.read_contents())
+            for xref, name, _, bbox in page.get_xobjects():
+                digest.update(f"{name} {bbox}".encode())
+                digest.update(doc.xref_stream(xref) or b"")
+            digest.update(repr([font[1:6] for font in page.get_fonts()]).encode())
+            keys.append(digest.hexdigest())
+
+    return keys
+
+
+class PageCache:
+    def __init__(self, cache_dir=default_cache_dir):
+        self.cache_dir = Path(cache_dir)
+
+    def _manifest_path(self, doc_key):
+        return self.cache_dir / "docs" / f"{doc_key}-v{extractor_version}.json"
+
+    def _page_path(self, page_key):
+        return self.cache_dir / "pages" / page_key[:2] / f"{page_key}.txt"
 
-    pages = [parse_page(page) for page in doc.pages()]
+    def _write(self, path, text):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial_path = path.with_name(f"{path.name}.partial")
+        partial_path.write_text(text)
+        partial_path.replace(path)
 
+    def read_manifest(self, doc_key):
+        path = self._manifest_path(doc_key)
+        if not path.exists():
+            return None
+
+        return json.loads(path.read_text())["pages"]
+
+    def write_manifest(self, doc_key, name, keys):
+        self._write(self._manifest_path(doc_key), json.dumps({"name": name, "pages": keys}))
+
+    def has_page(self, page_key):
+        return self._page_path(page_key).exists()
+
+    def read_page(self, page_key):
+        return self._page_path(page_key).read_text()
+
+    def write_page(self, page_key, text):
+        self._write(self._page_path(page_key), text)
+
+
+def iter_cached_pages(input_file, cache=None, executor=None, workers=None, pages_per_chunk=16):
+    cache = cache or PageCache()
+    doc_key = file_digest(input_file)
+
+    keys = cache.read_manifest(doc_key)
+    if keys is not None:
+        for key in keys:
+            yield cache.read_page(key)
+        return
+
+    keys = page_keys(input_file)
+    # Identical pages (blank pages, repeated disclaimers) share a key and are only parsed once
+    first_pages = {}
+    for page_number, key in enumerate(keys):
+        first_pages.setdefault(key, page_number)
+    missing = sorted(n for key, n in first_pages.items() if not cache.has_page(key))
+    parsed = iter_pages(
+        input_file=input_file,
+        page_numbers=missing,
+        executor=executor,
+        workers=workers,
+        pages_per_chunk=pages_per_chunk,
+    )
+
+    missing = set(missing)
+    for page_number, key in enumerate(keys):
+        if page_number in missing:
+            page = next(parsed)
+            cache.write_page(key, page)
+        else:
+            page = cache.read_page(key)
+
+        yield page
+
+    cache.write_manifest(doc_key, name=Path(input_file).name, keys=keys)
+
+
+def join_pages(pages) -> str:
     return "\n\n".join(pages)
 
 
-def _main():
-    base_dir = Path(__file__).parents[2]
-    data_dir = base_dir / "data"
-    input_file = data_dir / "JPM Electravision 14th Annual Energy Paper 20240305.pdf"
+def to_markdown(input_file):
+    return join_pages(iter_pages(input_file=input_file))
+
+
+def write_markdown(input_file, output_file, cache=None, executor=None, workers=None, pages_per_chunk=16):
+    partial_file = output_file.with_name(f"{output_file.name}.partial")
+
+    with partial_file.open("w") as f:
+        pages = iter_cached_pages(
+            input_file=input_file,
+            cache=cache,
+            executor=executor,
+            workers=workers,
+            pages_per_chunk=pages_per_chunk,
+        )
+        for page_number, page in enumerate(pages):
+            if page_number > 0:
+                f.write("\n\n")
+            f.write(page)
 
-    output = to_markdown(input_file=input_file)
+    # Readers only ever see a complete document
+    partial_file.replace(output_file)
 
-    output_dir = base_dir / "output"
+
+def extract_corpus(input_dir, output_dir, cache_dir=default_cache_dir, workers=None, pages_per_chunk=16):
     output_dir.mkdir(parents=True, exist_ok=True)
-    output_file = output_dir / f"{input_file.name}.txt"
-    output_file.write_text(output)
+    # A single PDF can be passed instead of a directory, to re-extract just that one
+    input_dir = Path(input_dir)
+    input_files = [input_dir] if input_dir.is_file() else sorted(input_dir.glob("*.pdf"))
+    cache = PageCache(cache_dir)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for input_file in input_files:
+            print(f"Extracting {input_file.name}")
+            write_markdown(
+                input_file=input_file,
+                output_file=output_dir / f"{input_file.name}.txt",
+                cache=cache,
+                executor=executor,
+                workers=workers,
+                pages_per_chunk=pages_per_chunk,
+            )
+
+
+def _main():
+    base_dir = Path(__file__).parents[1]
+
+    parser = argparse.ArgumentParser(description="Extract PDFs to text, through the page cache")
+    parser.add_argument("input", type=Path, nargs="?", default=base_dir / "data", help="A directory of PDFs, or one PDF")
+    parser.add_argument("--output", type=Path, default=base_dir / "output")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    extract_corpus(input_dir=args.input, output_dir=args.output, workers=args.workers)
 
 
 if __name__ == "__main__":
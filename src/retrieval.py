@@ -0,0 +1,130 @@
+import hashlib
+import json
+import math
+import re
+from collections import Counter
+from pathlib import Path
+
+# BM25 page index so prompts only carry the pages relevant to an instruction
+
+stop_words = {
+    "a", "an", "and", "any", "are", "as", "at", "be", "by", "for", "from", "how", "in", "is", "it",
+    "its", "not", "of", "on", "or", "that", "the", "their", "this", "to", "was", "were", "what",
+    "when", "where", "which", "with", "within",
+}  # fmt: skip
+
+
+def tokenize(text):
+    return [t for t in re.findall(r"[a-z0-9]+(?:\.[0-9]+)?", text.lower()) if t not in stop_words]
+
+
+def estimate_tokens(text):
+    # Claude averages roughly 4 characters per token on English prose
+    return math.ceil(len(text) / 4)
+
+
+def pages_digest(pages):
+    digest = hashlib.sha256()
+    for page in pages:
+        digest.update(page.encode())
+        digest.update(b"\x00")
+
+    return digest.hexdigest()
+
+
+def format_pages(pages, page_numbers):
+    return "\n\n".join(f"[Page {p}]\n{pages[p - 1]}" for p in sorted(page_numbers))
+
+
+class BM25Index:
+    def __init__(self, postings, doc_lengths, digest, k1=1.5, b=0.75):
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.digest = digest
+        self.k1 = k1
+        self.b = b
+        self.avg_length = sum(doc_lengths) / max(1, len(doc_lengths)) or 1
+
+    @classmethod
+    def build(cls, pages):
+        postings = {}
+        doc_lengths = []
+
+        for page_number, page in enumerate(pages, start=1):
+            terms = tokenize(page)
+            doc_lengths.append(len(terms))
+
+            for term, tf in Counter(terms).items():
+                postings.setdefault(term, {})[page_number] = tf
+
+        return cls(postings=postings, doc_lengths=doc_lengths, digest=pages_digest(pages))
+
+    @classmethod
+    def load(cls, path):
+        data = json.loads(Path(path).read_text())
+        postings = {
+            term: {int(page): tf for page, tf in pages.items()}
+            for term, pages in data["postings"].items()
+        }
+
+        return cls(postings=postings, doc_lengths=data["doc_lengths"], digest=data["digest"])
+
+    @classmethod
+    def load_or_build(cls, path, pages):
+        path = Path(path)
+        if path.exists():
+            index = cls.load(path)
+            if index.digest == pages_digest(pages):
+                return index
+
+        index = cls.build(pages)
+        index.save(path)
+
+        return index
+
+    def save(self, path):
+        data = {
+            "digest": self.digest,
+            "doc_lengths": self.doc_lengths,
+            "postings": self.postings,
+        }
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(data))
+
+    def scores(self, query):
+        n = len(self.doc_lengths)
+        scores = Counter()
+
+        for term in set(tokenize(query)):
+            pages = self.postings.get(term)
+            if not pages:
+                continue
+
+            idf = math.log(1 + (n - len(pages) + 0.5) / (len(pages) + 0.5))
+            for page_number, tf in pages.items():
+                length_norm = 1 - self.b + self.b * self.doc_lengths[page_number - 1] / self.avg_length
+                scores[page_number] += idf * tf * (self.k1 + 1) / (tf + self.k1 * length_norm)
+
+        return scores
+
+    def search(self, query, k=5):
+        return [page for page, _ in self.scores(query).most_common(k)]
+
+    def search_with_coverage(self, query, k=5, coverage=3):
+        # Top-k pages plus the best page from each of `coverage` equal slices of the document that the
+        # top-k missed, so cross-page instructions see more than one neighbourhood of the report
+        scores = self.scores(query)
+        selected = [page for page, _ in scores.most_common(k)]
+
+        n = len(self.doc_lengths)
+        for s in range(coverage):
+            start = s * n // coverage + 1
+            end = (s + 1) * n // coverage
+            in_slice = [p for p in range(start, end + 1) if scores[p] > 0]
+            if not in_slice or any(start <= p <= end for p in selected):
+                continue
+
+            selected.append(max(in_slice, key=lambda p: scores[p]))
+
+        return selected
@@ -0,0 +1,128 @@
+import re
+import time
+
+# Streams a completion and stops reading once every required closing tag has arrived
+
+tag_patterns = {}
+
+
+def tag_pattern(tag):
+    # Non-greedy and DOTALL, so multi-line values parse and the first complete tag wins
+    if tag not in tag_patterns:
+        tag_patterns[tag] = re.compile(rf"<{tag}>\s*(.*?)\s*</{tag}>", re.DOTALL)
+
+    return tag_patterns[tag]
+
+
+def find_tag(xml, tag):
+    match = tag_pattern(tag).search(xml)
+
+    return None if match is None else match.group(1)
+
+
+class TagStream:
+    def __init__(self, tags):
+        self.pending = {f"</{tag}>" for tag in tags}
+        self.overlap = max((len(closing) for closing in self.pending), default=0)
+        self.chunks = []
+        self.length = 0
+        self.tail = ""
+
+    def feed(self, chunk):
+        self.chunks.append(chunk)
+        self.length += len(chunk)
+
+        # Only the new text plus enough of the previous tail to catch a tag split across chunks
+        window = self.tail + chunk
+        self.pending = {closing for closing in self.pending if closing not in window}
+        self.tail = window[-self.overlap :] if self.overlap else ""
+
+        return self.complete
+
+    @property
+    def complete(self):
+        return len(self.pending) == 0
+
+    @property
+    def text(self):
+        return "".join(self.chunks)
+
+
+def llm_caches(model):
+    # The (cache, llm_string) pairs ainvoke would consult, through our wrappers: InstrumentedChatModel
+    # wraps one model, RoutedChatModel one per region
+    from langchain_core.caches import BaseCache
+    from langchain_core.globals import get_llm_cache
+    from langchain_core.language_models import BaseChatModel
+
+    # Chat models are checked first: ChatBedrock has a .model too, holding its model id
+    if isinstance(model, BaseChatModel):
+        models = [model]
+    elif hasattr(model, "models"):
+        models = list(model.models.values())
+    elif hasattr(model, "model"):
+        return llm_caches(model.model)
+    else:
+        return []
+
+    caches = {}
+    for chat_model in models:
+        cache = getattr(chat_model, "cache", False)
+        llm_cache = cache if isinstance(cache, BaseCache) else get_llm_cache()
+        if cache is not False and llm_cache is not None:
+            llm_string = chat_model._get_llm_string()
+            caches[(id(llm_cache), llm_string)] = (llm_cache, llm_string)
+
+    return list(caches.values())
+
+
+async def alookup_cached(model, prompt, caches):
+    start = time.perf_counter()
+    for llm_cache, llm_string in caches:
+        generations = await llm_cache.alookup(prompt, llm_string)
+        if generations:
+            # The wrapper never sees a cache hit served here, so record the call on its behalf
+            metrics = getattr(model, "metrics", None)
+            if metrics is not None:
+                record = metrics.current_record()
+                record["cache_hit"] = True
+                record["wall_seconds"] += time.perf_counter() - start
+
+            return str(generations[0].message.content)
+
+    return None
+
+
+async def astream_until_tags(model, messages, tags):
+    # model.astream bypasses langchain's LLM cache, so it's checked here under the same prompt and
+    # llm_string ainvoke uses, and the streamed text written back; entries are shared with ainvoke.
+    # A stream stopped early caches text that ends at the last required tag, which parses the same
+    caches = llm_caches(model)
+    if caches:
+        from langchain_core.load import dumps
+
+        prompt = dumps(messages)
+        cached = await alookup_cached(model, prompt, caches)
+        if cached is not None:
+            return cached
+
+    tag_stream = TagStream(tags)
+    stream = model.astream(input=messages)
+
+    try:
+        async for chunk in stream:
+            if tag_stream.feed(str(chunk.content)):
+                break
+    finally:
+        # Closing the generator cancels the underlying response, so trailing tokens aren't generated
+        await stream.aclose()
+
+    if caches:
+        from langchain_core.messages import AIMessage
+        from langchain_core.outputs import ChatGeneration
+
+        generations = [ChatGeneration(message=AIMessage(content=tag_stream.text))]
+        for llm_cache, llm_string in caches:
+            await llm_cache.aupdate(prompt, llm_string, generations)
+
+    return tag_stream.text